@@ -1,18 +1,35 @@
 import asyncio
 import logging
-from datetime import datetime
+import multiprocessing
+import signal
+import sys
+from functools import partial
 
 from aiogram import Bot, Dispatcher, types, executor
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher.middlewares import BaseMiddleware
 from aiogram.utils.exceptions import BotBlocked, ChatNotFound, TerminatedByOtherGetUpdates
+from aiohttp import web
 
-from app.config import BOT_TOKEN, PRICE_CHECK_INTERVAL
+from app.config import (
+    BOT_TOKEN, PRODUCT_URL_TEMPLATES, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_WORKERS, WEBHOOK_MAX_CONNECTIONS, PARSER_WORKERS, PARSER_WORKER_BASE_PORT,
+    METRICS_PATH,
+)
 from app import database as db
 from app.handlers.common import register_handlers_common
 from app.handlers.actions import register_handlers_actions
 from app.services.ozon_parser import OzonParser
 from app.services.wildberries_parser import WildberriesParser
+from app.services.price_scheduler import PriceCheckScheduler
+from app.services.price_history import price_history
+from app.services.send_queue import send_queue, PRIORITY_ALERT
+from app.services.file_id_cache import photo_file_ids
+from app.services.search_sessions import search_sessions
+from app.services.fair_scheduler import current_user
+from app.services.fsm_storage import SQLiteStorage
+from app.services.metrics import metrics, register_parser_metrics
+from app.services.parser_workers import ParserWorkerPool, RemoteParser
+from app.webhook import TelegramWebhookHandler, metrics_handler, drain_updates
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -27,95 +44,170 @@ class ParsersMiddleware(BaseMiddleware):
     async def on_process_message(self, message: types.Message, data: dict):
         data['ozon_parser'] = self.ozon_parser
         data['wb_parser'] = self.wb_parser
+        # Парсинг, запущенный обработчиком, встаёт в очередь браузеров от имени этого пользователя
+        current_user.set(message.from_user.id)
 
     async def on_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
         data['ozon_parser'] = self.ozon_parser
         data['wb_parser'] = self.wb_parser
+        current_user.set(callback_query.from_user.id)
 
 
-async def check_prices_periodically(bot: Bot, parser: OzonParser):
+async def _notify_price_drop(bot: Bot, user_id, product_id, store, name, old_price, new_price, desired_price) -> bool:
+    """Отправляет уведомление о снижении цены. True — отслеживание можно удалять."""
+    text = (f"🎉 <b>Цена снижена!</b>\n\n"
+            f"<b>{name}</b>\n"
+            f"Старая цена: {old_price} ₽\n"
+            f"Новая цена: <b>{int(new_price)} ₽</b> (ваша цель: {desired_price} ₽)\n\n"
+            f"{PRODUCT_URL_TEMPLATES[store].format(product_id)}")
+    try:
+        await send_queue.send(user_id, bot.send_message, user_id, text, priority=PRIORITY_ALERT)
+        logging.info(f"Уведомление отправлено пользователю {user_id} и товар удален из отслеживания.")
+        return True
+    except (BotBlocked, ChatNotFound):
+        logging.warning(f"Пользователь {user_id} заблокировал бота. Удаляем его отслеживание товара {product_id}.")
+        return True
+    except Exception as e:
+        logging.error(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
+        return False
+
+
+async def check_prices_periodically(bot: Bot, parser: OzonParser, wb_parser: WildberriesParser):
 
     await asyncio.sleep(20)
-    logging.info("Фоновая задача проверки цен запущена.")
-    
-    while True:
-        logging.info("Начинаю плановую проверку цен Ozon...")
-        try:
-            all_tracked_items = await db.get_all_tracking_from_db()
-            
-            if not all_tracked_items:
-                logging.info("Нет товаров для отслеживания. Следующая проверка через {} секунд.".format(PRICE_CHECK_INTERVAL))
-            else:
-                logging.info(f"Найдено {len(all_tracked_items)} товаров для проверки.")
-                for user_id, product_id, name, desired_price, old_price in all_tracked_items:
-                    logging.info(f"Проверяю товар {product_id} для пользователя {user_id}...")
-                    
-                    product_data = await parser.get_product_data(product_id)
-                    # Добавляем задержку между запросами, чтобы не получить бан
-                    await asyncio.sleep(5) 
-                    
-                    if product_data and product_data.get('price'):
-                        # Используем цену с картой, если она выгоднее
-                        new_price = product_data.get('price_with_card') or product_data.get('price')
-                        
-                        # Обновляем текущую цену в БД
-                        await db.update_tracking_in_db(user_id, product_id, int(new_price), datetime.now().isoformat())
-                        
-                        # Сравниваем с желаемой ценой
-                        if new_price <= desired_price:
-                            logging.info(f"ЦЕНА СНИЖЕНА! Товар {product_id}, новая цена {new_price} <= желаемой {desired_price}.")
-                            text = (f"🎉 <b>Цена снижена!</b>\n\n"
-                                    f"<b>{name}</b>\n"
-                                    f"Старая цена: {old_price} ₽\n"
-                                    f"Новая цена: <b>{int(new_price)} ₽</b> (ваша цель: {desired_price} ₽)\n\n"
-                                    f"https://ozon.ru/product/{product_id}/")
-                            try:
-                                await bot.send_message(user_id, text)
-                                # После успешной отправки удаляем товар из отслеживания
-                                await db.remove_tracking_from_db(user_id, product_id)
-                                logging.info(f"Уведомление отправлено пользователю {user_id} и товар удален из отслеживания.")
-                            except (BotBlocked, ChatNotFound):
-                                logging.warning(f"Пользователь {user_id} заблокировал бота. Удаляем все его отслеживания.")
-                                await db.remove_tracking_from_db(user_id, product_id)
-                        else:
-                            logging.info(f"Цена на товар {product_id} не изменилась значительно ({new_price} > {desired_price}).")
-                    else:
-                        logging.warning(f"Не удалось получить данные для товара {product_id} при плановой проверке.")
-
-        except Exception as e:
-            logging.error(f"Критическая ошибка в фоновой задаче проверки цен: {e}")
-        
-        # Ждем следующей проверки
-        await asyncio.sleep(PRICE_CHECK_INTERVAL)
+    scheduler = PriceCheckScheduler(parser, wb_parser, partial(_notify_price_drop, bot))
+    metrics.register('price_checks', scheduler.stats)
+    await scheduler.run()
 
 # Функции запуска и остановки
 async def on_startup(dp: Dispatcher):
     await db.initialize_db()
+    send_queue.start()
+    metrics.register('send_queue', send_queue.stats)
+    metrics.register('price_history', price_history.stats)
+    metrics.register('photo_file_ids', photo_file_ids.stats)
+    metrics.register('search_sessions', search_sessions.stats)
+    metrics.register('fsm_storage', dp.storage.stats)
     
-    ozon_parser = OzonParser()
-    wb_parser = WildberriesParser()
+    if PARSER_WORKERS:
+        # У каждого воркера вебхука свои процессы парсинга на своих портах
+        base_port = PARSER_WORKER_BASE_PORT + dp.get('worker_index', 0) * PARSER_WORKERS
+        parser_pool = ParserWorkerPool(PARSER_WORKERS, base_port)
+        await parser_pool.start()
+        dp['parser_pool'] = parser_pool
+        metrics.register('parser_workers', parser_pool.stats)
+        ozon_parser = RemoteParser(parser_pool, 'ozon')
+        wb_parser = RemoteParser(parser_pool, 'wb')
+    else:
+        ozon_parser = OzonParser()
+        wb_parser = WildberriesParser()
+        # С воркерами парсинга эта статистика живёт в них и пишется в их лог
+        register_parser_metrics(ozon_parser)
+    await wb_parser.start()
     
     dp.middleware.setup(ParsersMiddleware(ozon_parser, wb_parser))
     dp['ozon_parser'] = ozon_parser
+    dp['wb_parser'] = wb_parser
     
-    asyncio.create_task(check_prices_periodically(dp.bot, ozon_parser))
+    # Вебхук регистрирует и цены проверяет только первый воркер, иначе уведомления задвоятся
+    if dp.get('worker_index', 0) == 0:
+        if BOT_MODE == 'webhook' and WEBHOOK_URL:
+            await dp.bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                                     max_connections=WEBHOOK_MAX_CONNECTIONS)
+            logging.info(f"Вебхук зарегистрирован: {WEBHOOK_URL + WEBHOOK_PATH}")
+        asyncio.create_task(check_prices_periodically(dp.bot, ozon_parser, wb_parser))
+    asyncio.create_task(price_history.run())
+    asyncio.create_task(photo_file_ids.run())
+    asyncio.create_task(dp.storage.run())
+    asyncio.create_task(metrics.run())
 
 async def on_shutdown(dp: Dispatcher):
+    # Сначала обновления в обработке: им ещё нужны парсеры, очередь отправки и БД
+    await drain_updates()
     ozon_parser = dp.get('ozon_parser')
     if ozon_parser:
-        ozon_parser.quit()
+        await ozon_parser.quit()
+    wb_parser = dp.get('wb_parser')
+    if wb_parser:
+        await wb_parser.quit()
+    parser_pool = dp.get('parser_pool')
+    if parser_pool:
+        await parser_pool.close()
+    try:
+        await price_history.flush()
+        await photo_file_ids.flush()
+        # aiogram закрывает хранилище уже после on_shutdown — сохраняем состояния, пока БД открыта
+        await dp.storage.close()
+    except Exception as e:
+        logging.error(f"Не удалось сохранить историю цен, кэш file_id и состояния диалогов при остановке: {e}")
+    await send_queue.close()
+    await db.close_db()
     logging.warning('Бот остановлен.')
 
-# Главная функция
-def main():
+def create_dispatcher() -> Dispatcher:
     bot = Bot(token=BOT_TOKEN, parse_mode=types.ParseMode.HTML)
-    storage = MemoryStorage()
+    # Несколько воркеров делят одну БД: состояния диалогов не кэшируются в памяти процесса
+    storage = SQLiteStorage(shared=WEBHOOK_WORKERS > 1)
     dp = Dispatcher(bot, storage=storage)
 
     # Регистрация всех обработчиков
     register_handlers_common(dp)
     register_handlers_actions(dp)
+    return dp
+
+def run_webhook_worker(index: int):
+    """Воркер вебхука: aiohttp-сервер на WEBAPP_PORT + index."""
+    dp = create_dispatcher()
+    dp['worker_index'] = index
+    runner = executor.Executor(dp)
+    runner.on_startup(on_startup)
+    runner.on_shutdown(on_shutdown)
+    app = web.Application()
+    app.router.add_get(METRICS_PATH, metrics_handler)
+    logging.info(f"Воркер {index} принимает вебхук на http://{WEBAPP_HOST}:{WEBAPP_PORT + index}{WEBHOOK_PATH}")
+    runner.set_webhook(webhook_path=WEBHOOK_PATH, request_handler=TelegramWebhookHandler, web_app=app)
+    runner.run_app(host=WEBAPP_HOST, port=WEBAPP_PORT + index, print=None)
+
+async def _migrate_db():
+    await db.initialize_db()
+    await db.close_db()
+
+def run_webhook_workers():
+    """
+    Запускает WEBHOOK_WORKERS процессов за локальным обратным прокси.
+    Миграции применяются заранее, чтобы воркеры не запускали их одновременно.
+    """
+    asyncio.run(_migrate_db())
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=run_webhook_worker, args=(index,), name=f"webhook-{index}")
+               for index in range(WEBHOOK_WORKERS)]
+    for worker in workers:
+        worker.start()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # Ctrl+C получила вся группа процессов — воркеры уже завершаются сами
+        pass
+    except SystemExit:
+        # Воркеры корректно завершаются по SIGTERM: сохраняют состояния и закрывают браузеры
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+    for worker in workers:
+        worker.join()
 
+# Главная функция
+def main():
+    if BOT_MODE == 'webhook':
+        if WEBHOOK_WORKERS > 1:
+            run_webhook_workers()
+        else:
+            run_webhook_worker(0)
+        return
+
+    dp = create_dispatcher()
     try:
         executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
     except TerminatedByOtherGetUpdates:
@@ -1,3 +1,4 @@
+import hashlib
 import os
 from dotenv import load_dotenv
 
@@ -7,6 +8,141 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("Не найден токен бота в .env файле! Создайте .env и добавьте BOT_TOKEN=...")
 
-ITEMS_PER_SEARCH = 3
+# Получение обновлений: 'polling' (по умолчанию) или 'webhook'
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+if BOT_MODE not in ('polling', 'webhook'):
+    raise ValueError(f"Неизвестный BOT_MODE={BOT_MODE!r}: ожидается 'polling' или 'webhook'.")
+# Публичный адрес обратного прокси, например https://bot.example.com. Пусто — вебхук
+# в Telegram не регистрируется (локальная отладка: обновления присылаются POST-запросами).
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip('/')
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Telegram присылает его в заголовке X-Telegram-Bot-Api-Secret-Token; по умолчанию выводится из токена
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "127.0.0.1")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", 8080))  # воркер i слушает WEBAPP_PORT + i
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 1)) if BOT_MODE == 'webhook' else 1
+WEBHOOK_MAX_CONNECTIONS = 40  # одновременных соединений Telegram к вебхуку
+WEBHOOK_DRAIN_TIMEOUT = 10  # сколько при остановке ждать обновления, уже принятые в обработку, секунд
+
+# Статистика сервисов: в лог раз в METRICS_LOG_INTERVAL секунд и JSON по METRICS_PATH на сервере вебхука
+# (запрос — с тем же секретным заголовком, что и у вебхука)
+METRICS_LOG_INTERVAL = int(os.getenv("METRICS_LOG_INTERVAL", 5 * 60))
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+
+ITEMS_PER_SEARCH = 3  # товаров на странице при поиске в одном магазине
+SEARCH_RESULTS_LIMIT = 20  # сколько товаров запрашивать у магазина для постраничного просмотра
 PRICE_CHECK_INTERVAL = 3600  # 1 час
-DB_NAME = 'ozon_bot.db'
\ No newline at end of file
+DB_NAME = 'ozon_bot.db'
+DB_CACHE_SIZE_KB = 16 * 1024  # кэш страниц SQLite
+DB_BUSY_TIMEOUT_MS = 5000
+
+# Ссылки на товар по коду магазина ('ozon' / 'wb')
+PRODUCT_URL_TEMPLATES = {
+    'ozon': "https://ozon.ru/product/{}/",
+    'wb': "https://www.wildberries.ru/catalog/{}/detail.aspx",
+}
+WB_DETAIL_BATCH_SIZE = 200  # артикулов в одном запросе к card.wb.ru
+
+# Пул драйверов Selenium для Ozon
+OZON_DRIVERS_POOL_SIZE = int(os.getenv("OZON_DRIVERS_POOL_SIZE", 3))
+OZON_DRIVER_MAX_PAGES = 200  # пересоздавать драйвер после N страниц
+OZON_DRIVER_MAX_MEMORY_MB = 1536  # ...или когда chromedriver с Chrome занимают больше (суммарный RSS, МБ)
+
+# Парсеры в отдельных процессах (python -m app.worker). 0 — парсинг в процессе бота,
+# 'auto' — по процессу на ядро, кроме одного для бота. Пул браузеров — у каждого воркера свой.
+_parser_workers = os.getenv("PARSER_WORKERS", "0")
+PARSER_WORKERS = max(1, (os.cpu_count() or 2) - 1) if _parser_workers == 'auto' else int(_parser_workers)
+PARSER_WORKER_HOST = '127.0.0.1'
+PARSER_WORKER_BASE_PORT = int(os.getenv("PARSER_WORKER_BASE_PORT", 8200))  # воркер i слушает порт BASE + i
+PARSER_CALL_TIMEOUT = 120  # секунд на вызов; для потоковой выдачи — между соседними товарами
+PARSER_CONNECT_TIMEOUT = 10  # сколько ждать запуска воркера, секунд
+PARSER_RESTART_DELAY = 1  # пауза перед перезапуском упавшего воркера, удваивается до PARSER_RESTART_MAX_DELAY
+PARSER_RESTART_MAX_DELAY = 60
+PARSER_STOP_TIMEOUT = 30  # сколько ждать корректного завершения воркера, секунд
+
+# Справедливое распределение браузеров между пользователями
+SCRAPE_CLASS_WEIGHTS = {'interactive': 4, 'background': 1}
+SCRAPE_USER_MAX_CONCURRENCY = 2  # браузеров одновременно на одного пользователя
+# Хотя бы один браузер всегда свободен для людей; при одном браузере фон берёт его,
+# только когда людей в очереди нет (начатую проверку человек может подождать)
+SCRAPE_BACKGROUND_MAX_SLOTS = max(1, OZON_DRIVERS_POOL_SIZE - 1)
+SCRAPE_MAX_WAIT = {'interactive': 45, 'background': 10 * 60}  # дольше ждать в очереди нельзя, секунд
+
+# HTTP-клиент (aiohttp)
+HTTP_POOL_LIMIT = 100
+HTTP_POOL_LIMIT_PER_HOST = 20
+HTTP_DNS_CACHE_TTL = 300  # секунд
+HTTP_KEEPALIVE_TIMEOUT = 30  # секунд
+HTTP_CONNECT_TIMEOUT = 5  # секунд
+HTTP_READ_TIMEOUT = 15  # секунд
+HTTP_RETRIES = 3
+HTTP_RETRY_BASE_DELAY = 0.5  # секунд
+
+# Кэш результатов поиска
+SEARCH_CACHE_MAX_ENTRIES = 500
+SEARCH_CACHE_MAX_BYTES = 20 * 1024 * 1024
+SEARCH_CACHE_TTL = {'ozon': 30 * 60, 'wb': 10 * 60}  # секунд
+
+# Кэш данных о товарах (stale-while-revalidate)
+PRODUCT_CACHE_MAX_ENTRIES = 5000
+PRODUCT_CACHE_TTL = 6 * 3600  # после этого запись удаляется совсем
+PRODUCT_MAX_AGE = 15 * 60  # свежесть по умолчанию
+FAVORITE_MAX_AGE = 60 * 60  # для избранного хватит данных, которые пользователь только что видел
+
+# Планировщик проверки цен
+PRICE_SCHEDULER_TICK = 30  # как часто забирать из БД товары, которым пора на проверку, секунд
+PRICE_CHECK_CONCURRENCY = 3
+PRICE_CHECK_RATE = {'ozon': 0.2, 'wb': 2}  # запросов в секунду на магазин
+PRICE_CHECK_BURST = {'ozon': 1, 'wb': 5}
+PRICE_CHECK_JITTER = 0.1  # ±10% к интервалу, чтобы проверки не шли пачками
+PRICE_CHECK_RETRY_DELAY = 15 * 60  # повтор после неудачной проверки, секунд
+PRICE_NEAR_TARGET_RATIO = 0.05  # «близко к цели» — не дальше 5% от желаемой цены
+PRICE_NEAR_TARGET_FACTOR = 0.5  # такие товары проверяются в 2 раза чаще
+
+# Сессии поиска для постраничного просмотра
+SEARCH_SESSION_TTL = 30 * 60  # секунд
+SEARCH_SESSION_MAX_ENTRIES = 5000
+SEARCH_SESSION_MAX_BYTES = 20 * 1024 * 1024
+
+# Режим «лучшее» (Ozon + WB)
+BEST_TOP_K = 5
+BEST_CANDIDATES = 20  # товаров с каждого магазина
+BEST_PREVIEW_INTERVAL = 2  # не чаще одного обновления предварительного топа, секунд
+BEST_MAX_COUNT = 10_000_000  # для оценки сверху: больше отзывов или покупок у товара не бывает
+
+# История цен
+PRICE_HISTORY_FLUSH_INTERVAL = 60  # как часто сбрасывать накопленные наблюдения в БД, секунд
+PRICE_HISTORY_RAW_DAYS = 14  # точки старше сворачиваются в дневные min/max
+PRICE_HISTORY_RETENTION_DAYS = 365  # дневные агрегаты старше удаляются
+PRICE_LOW_WINDOW_DAYS = 30  # окно для отметки «самая низкая цена»
+PRICE_RECENT_POINTS = 5  # последних изменений цены в списке отслеживаний
+
+# Очередь исходящих сообщений Telegram
+# Общий лимит Telegram делится между процессами-воркерами
+SEND_GLOBAL_RATE = 25 / WEBHOOK_WORKERS  # сообщений в секунду на бота (лимит Telegram — около 30)
+SEND_GLOBAL_BURST = max(1, 30 // WEBHOOK_WORKERS)
+SEND_CHAT_RATE = 1  # сообщений в секунду в один чат
+SEND_CHAT_BURST = 5  # короткая пачка карточек уходит без пауз
+SEND_CONCURRENCY = 10  # одновременных запросов к Bot API
+SEND_RETRIES = 3
+SEND_RETRY_BASE_DELAY = 1  # секунд
+
+# Кэш file_id картинок товаров
+PHOTO_FILE_ID_MAX_ENTRIES = 50_000  # в БД; сверх лимита удаляются давно не использованные
+PHOTO_FILE_ID_MEMORY_ENTRIES = 2000
+PHOTO_FILE_ID_TTL = 30 * 24 * 3600  # секунд без использования
+PHOTO_FILE_ID_FLUSH_INTERVAL = 5 * 60  # как часто сохранять время использования и чистить БД, секунд
+
+# Хранилище состояний диалогов (FSM) в SQLite
+FSM_STATE_TTL = 24 * 3600  # секунд без активности, после которых незавершённый диалог забывается
+FSM_MEMORY_ENTRIES = 5000  # активных диалогов в памяти
+FSM_MEMORY_TTL = 10 * 60  # секунд простоя, после которых состояние остаётся только в БД
+FSM_FLUSH_INTERVAL = 5  # как часто записывать изменения в БД, секунд
+FSM_FLUSH_BATCH = 500  # при стольких несохранённых изменениях запись начинается сразу
+
+# Адаптивный троттлинг и предохранитель для парсеров
+THROTTLE_BASE_DELAY = 1  # секунд
+THROTTLE_MAX_DELAY = 60  # секунд
+CIRCUIT_FAILURE_THRESHOLD = 5  # ошибок подряд до размыкания
+CIRCUIT_OPEN_SECONDS = 60
+CIRCUIT_MAX_OPEN_SECONDS = 30 * 60
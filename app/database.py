@@ -1,75 +1,527 @@
+import asyncio
 import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from itertools import groupby
+
 import aiosqlite
-from .config import DB_NAME
+from .config import DB_NAME, DB_CACHE_SIZE_KB, DB_BUSY_TIMEOUT_MS, PRICE_CHECK_INTERVAL
+
+# Одно долгоживущее соединение на весь процесс: открывается в initialize_db,
+# закрывается в close_db. sqlite3 кэширует подготовленные выражения по тексту
+# запроса, поэтому повторные вызовы не компилируют SQL заново.
+_db: aiosqlite.Connection | None = None
+_write_lock = asyncio.Lock()
+
+async def _connect() -> aiosqlite.Connection:
+    db = await aiosqlite.connect(DB_NAME, cached_statements=256)
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    await db.execute("PRAGMA temp_store=MEMORY")
+    await db.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    return db
+
+def _get_db() -> aiosqlite.Connection:
+    if _db is None:
+        raise RuntimeError("База данных не инициализирована. Сначала вызовите initialize_db().")
+    return _db
+
+@asynccontextmanager
+async def _transaction():
+    """Группа записей в одной транзакции; запись сериализуется между корутинами."""
+    db = _get_db()
+    async with _write_lock:
+        try:
+            yield db
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+async def _fetchall(sql, params=()):
+    cursor = await _get_db().execute(sql, params)
+    try:
+        return await cursor.fetchall()
+    finally:
+        await cursor.close()
+
+async def _ensure_column(db, table, column, definition):
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    columns = [row[1] for row in await cursor.fetchall()]
+    if column not in columns:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def _to_kopecks(rubles) -> int | None:
+    return None if rubles is None else int(round(float(rubles) * 100))
+
+def _to_rubles(kopecks) -> int | None:
+    return None if kopecks is None else kopecks // 100
+
+# Миграции схемы. Номер применённой миграции хранится в PRAGMA user_version,
+# новые миграции добавляются только в конец списка MIGRATIONS.
+async def _migration_initial(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS favorites (
+            user_id INTEGER, product_id TEXT, name TEXT, price TEXT,
+            PRIMARY KEY (user_id, product_id)
+        )''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS tracking (
+            user_id INTEGER, product_id TEXT, name TEXT, desired_price INTEGER,
+            current_price INTEGER, last_check TEXT,
+            PRIMARY KEY (user_id, product_id)
+        )''')
+
+async def _migration_store_column(db):
+    # Базы, созданные до поддержки WB, не имеют колонки store
+    await _ensure_column(db, 'favorites', 'store', "TEXT DEFAULT 'ozon'")
+    await _ensure_column(db, 'tracking', 'store', "TEXT DEFAULT 'ozon'")
+
+async def _migration_typed_prices(db):
+    """Цены в копейках (INTEGER), время проверок — unix-время, плюс next_check_at."""
+    now = int(time.time())
+    # На всякий случай: временные таблицы не должны мешать пересборке
+    await db.execute("DROP TABLE IF EXISTS favorites_new")
+    await db.execute("DROP TABLE IF EXISTS tracking_new")
+    await db.execute('''
+        CREATE TABLE favorites_new (
+            user_id INTEGER NOT NULL, product_id TEXT NOT NULL, store TEXT NOT NULL DEFAULT 'ozon',
+            name TEXT, price INTEGER,
+            PRIMARY KEY (user_id, product_id)
+        )''')
+    cursor = await db.execute("SELECT user_id, product_id, store, name, price FROM favorites")
+    rows = []
+    for user_id, product_id, store, name, price in await cursor.fetchall():
+        digits = "".join(filter(str.isdigit, str(price or "")))
+        rows.append((user_id, product_id, store or 'ozon', name, int(digits) * 100 if digits else None))
+    await db.executemany("INSERT INTO favorites_new VALUES (?, ?, ?, ?, ?)", rows)
+
+    await db.execute('''
+        CREATE TABLE tracking_new (
+            user_id INTEGER NOT NULL, product_id TEXT NOT NULL, store TEXT NOT NULL DEFAULT 'ozon',
+            name TEXT, desired_price INTEGER, current_price INTEGER,
+            last_check INTEGER, next_check_at INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, product_id)
+        )''')
+    cursor = await db.execute("SELECT user_id, product_id, store, name, desired_price, current_price, last_check FROM tracking")
+    rows = []
+    for user_id, product_id, store, name, desired_price, current_price, last_check in await cursor.fetchall():
+        try:
+            last_check_ts = int(datetime.fromisoformat(last_check).timestamp()) if last_check else None
+        except ValueError:
+            last_check_ts = None
+        rows.append((user_id, product_id, store or 'ozon', name,
+                     _to_kopecks(desired_price), _to_kopecks(current_price), last_check_ts, now))
+    await db.executemany("INSERT INTO tracking_new VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    await db.execute("DROP TABLE favorites")
+    await db.execute("ALTER TABLE favorites_new RENAME TO favorites")
+    await db.execute("DROP TABLE tracking")
+    await db.execute("ALTER TABLE tracking_new RENAME TO tracking")
+
+async def _migration_indexes(db):
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_tracking_product ON tracking (store, product_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_tracking_next_check ON tracking (next_check_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_favorites_product ON favorites (store, product_id)")
+
+async def _migration_price_history(db):
+    """
+    История цен: в price_history пишутся только изменения цены (run-length),
+    старые точки сворачиваются в дневные min/max в price_history_daily.
+    Первичные ключи начинаются с (store, product_id) и служат индексами.
+    """
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS price_history (
+            store TEXT NOT NULL, product_id TEXT NOT NULL, ts INTEGER NOT NULL, price INTEGER NOT NULL,
+            PRIMARY KEY (store, product_id, ts)
+        ) WITHOUT ROWID''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS price_history_daily (
+            store TEXT NOT NULL, product_id TEXT NOT NULL, day INTEGER NOT NULL,
+            min_price INTEGER NOT NULL, max_price INTEGER NOT NULL, last_price INTEGER NOT NULL,
+            PRIMARY KEY (store, product_id, day)
+        ) WITHOUT ROWID''')
+
+async def _migration_photo_file_ids(db):
+    """Кэш file_id, которые Telegram вернул после первой загрузки картинки товара."""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS photo_file_ids (
+            image_url TEXT PRIMARY KEY, file_id TEXT NOT NULL, last_used INTEGER NOT NULL
+        ) WITHOUT ROWID''')
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_photo_file_ids_last_used ON photo_file_ids (last_used)")
+
+async def _migration_fsm_states(db):
+    """Состояния диалогов, чтобы незавершённый поиск или отслеживание переживали перезапуск."""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            chat INTEGER NOT NULL, user INTEGER NOT NULL, state TEXT,
+            data TEXT NOT NULL, bucket TEXT NOT NULL, updated_at INTEGER NOT NULL,
+            PRIMARY KEY (chat, user)
+        ) WITHOUT ROWID''')
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states (updated_at)")
+
+async def _migration_search_sessions(db):
+    """Результаты поиска для листания страниц, общие для процессов-воркеров вебхука."""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS search_sessions (
+            id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, query TEXT NOT NULL,
+            page_size INTEGER NOT NULL, ranked INTEGER NOT NULL, items TEXT NOT NULL,
+            expires_at INTEGER NOT NULL
+        ) WITHOUT ROWID''')
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_search_sessions_expires_at ON search_sessions (expires_at)")
+
+MIGRATIONS = [
+    _migration_initial,
+    _migration_store_column,
+    _migration_typed_prices,
+    _migration_indexes,
+    _migration_price_history,
+    _migration_photo_file_ids,
+    _migration_fsm_states,
+    _migration_search_sessions,
+]
+
+async def _apply_migrations(db):
+    """
+    Каждая миграция — отдельная явная транзакция вместе с user_version.
+    Без явного BEGIN sqlite3 выполняет DDL (CREATE/DROP/ALTER) вне транзакции,
+    и сбой посреди миграции оставлял бы схему наполовину изменённой.
+    BEGIN IMMEDIATE заодно не даёт двум процессам применить одну миграцию дважды.
+    """
+    while True:
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = await db.execute("PRAGMA user_version")
+            version = (await cursor.fetchone())[0]
+            if version >= len(MIGRATIONS):
+                await db.commit()
+                return
+            migration = MIGRATIONS[version]
+            logging.info(f"Применяю миграцию БД #{version + 1}: {migration.__name__}")
+            await migration(db)
+            await db.execute(f"PRAGMA user_version = {version + 1}")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
 
 async def initialize_db():
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS favorites (
-                user_id INTEGER, product_id TEXT, name TEXT, price TEXT,
-                PRIMARY KEY (user_id, product_id)
-            )''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS tracking (
-                user_id INTEGER, product_id TEXT, name TEXT, desired_price INTEGER,
-                current_price INTEGER, last_check TEXT,
-                PRIMARY KEY (user_id, product_id)
-            )''')
-        await db.commit()
+    global _db
+    if _db is None:
+        _db = await _connect()
+    async with _write_lock:
+        await _apply_migrations(_db)
     logging.info("База данных инициализирована.")
 
-# Функции для избранного
-async def add_favorite_to_db(user_id, product_id, name, price):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def close_db():
+    global _db
+    if _db is not None:
+        await _db.close()
+        _db = None
+        logging.info("Соединение с базой данных закрыто.")
+
+# Функции для избранного. Цены снаружи — в рублях, в базе — в копейках.
+async def add_favorite_to_db(user_id, product_id, name, price, store='ozon'):
+    async with _transaction() as db:
         await db.execute(
-            "INSERT OR REPLACE INTO favorites (user_id, product_id, name, price) VALUES (?, ?, ?, ?)",
-            (user_id, product_id, name, f"{price} ₽")
+            "INSERT OR REPLACE INTO favorites (user_id, product_id, store, name, price) VALUES (?, ?, ?, ?, ?)",
+            (user_id, product_id, store, name, _to_kopecks(price))
         )
-        await db.commit()
 
 async def remove_favorite_from_db(user_id, product_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _transaction() as db:
         await db.execute("DELETE FROM favorites WHERE user_id = ? AND product_id = ?", (user_id, product_id))
-        await db.commit()
 
 async def get_favorites_from_db(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT product_id, name, price FROM favorites WHERE user_id = ?", (user_id,))
-        return await cursor.fetchall()
+    rows = await _fetchall("SELECT product_id, name, price, store FROM favorites WHERE user_id = ?", (user_id,))
+    return [(product_id, name, _to_rubles(price), store) for product_id, name, price, store in rows]
 
 async def is_favorite_in_db(user_id, product_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT 1 FROM favorites WHERE user_id = ? AND product_id = ?", (user_id, product_id))
-        return await cursor.fetchone() is not None
+    rows = await _fetchall("SELECT 1 FROM favorites WHERE user_id = ? AND product_id = ?", (user_id, product_id))
+    return bool(rows)
+
+async def get_favorite_ids(user_id, product_ids) -> set[str]:
+    """Какие из product_ids уже в избранном у пользователя — одним запросом."""
+    product_ids = [str(p) for p in product_ids]
+    if not product_ids:
+        return set()
+    placeholders = ", ".join("?" * len(product_ids))
+    rows = await _fetchall(
+        f"SELECT product_id FROM favorites WHERE user_id = ? AND product_id IN ({placeholders})",
+        (user_id, *product_ids)
+    )
+    return {row[0] for row in rows}
 
 # Функции для отслеживания
-async def add_tracking_to_db(user_id, product_id, name, desired_price, current_price, last_check):
-     async with aiosqlite.connect(DB_NAME) as db:
+async def add_tracking_to_db(user_id, product_id, name, desired_price, current_price, store='ozon'):
+    now = int(time.time())
+    async with _transaction() as db:
         await db.execute(
-            "INSERT OR REPLACE INTO tracking (user_id, product_id, name, desired_price, current_price, last_check) VALUES (?, ?, ?, ?, ?, ?)",
-            (user_id, product_id, name, desired_price, current_price, last_check)
+            "INSERT OR REPLACE INTO tracking (user_id, product_id, store, name, desired_price, current_price, last_check, next_check_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, product_id, store, name, _to_kopecks(desired_price), _to_kopecks(current_price),
+             now, now + PRICE_CHECK_INTERVAL)
         )
-        await db.commit()
 
 async def remove_tracking_from_db(user_id, product_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _transaction() as db:
         await db.execute("DELETE FROM tracking WHERE user_id = ? AND product_id = ?", (user_id, product_id))
-        await db.commit()
 
 async def get_tracking_from_db(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT product_id, name, desired_price, current_price FROM tracking WHERE user_id = ?", (user_id,))
-        return await cursor.fetchall()
+    rows = await _fetchall(
+        "SELECT product_id, name, desired_price, current_price, store FROM tracking WHERE user_id = ?", (user_id,)
+    )
+    return [(product_id, name, _to_rubles(desired), _to_rubles(current), store)
+            for product_id, name, desired, current, store in rows]
 
-async def get_all_tracking_from_db():
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT user_id, product_id, name, desired_price, current_price FROM tracking")
-        return await cursor.fetchall()
+async def get_due_tracking_from_db(now: int | None = None, limit: int = -1):
+    """Отслеживания, время проверки которых наступило (индекс по next_check_at)."""
+    rows = await _fetchall(
+        "SELECT user_id, product_id, name, desired_price, current_price, store FROM tracking "
+        "WHERE next_check_at <= ? ORDER BY next_check_at LIMIT ?",
+        (int(time.time()) if now is None else now, limit)
+    )
+    return [(user_id, product_id, name, _to_rubles(desired), _to_rubles(current), store)
+            for user_id, product_id, name, desired, current, store in rows]
+
+async def _update_tracking_prices(db, items):
+    now = int(time.time())
+    await db.executemany(
+        "UPDATE tracking SET current_price = ?, last_check = ?, next_check_at = ? WHERE user_id = ? AND product_id = ?",
+        [(_to_kopecks(new_price), now, int(next_check_at), user_id, product_id)
+         for user_id, product_id, new_price, next_check_at in items]
+    )
+
+async def apply_price_check_results(updates, removals, postponed=()):
+    """
+    Записывает итоги проверки цен одной транзакцией.
+    updates: (user_id, product_id, new_price, next_check_at);
+    removals: (user_id, product_id);
+    postponed: (store, product_id, next_check_at) — товары, которые не удалось проверить.
+    """
+    if not updates and not removals and not postponed:
+        return
+    async with _transaction() as db:
+        await _update_tracking_prices(db, updates)
+        await db.executemany("DELETE FROM tracking WHERE user_id = ? AND product_id = ?", removals)
+        await db.executemany(
+            "UPDATE tracking SET next_check_at = ? WHERE store = ? AND product_id = ?",
+            [(int(next_check_at), store, product_id) for store, product_id, next_check_at in postponed]
+        )
+
+# История цен. Цены снаружи — в рублях, в базе — в копейках, время — unix.
+_DAY = 24 * 3600
+
+async def add_price_points(points):
+    """
+    points: список кортежей (store, product_id, ts, price).
+    Точка записывается, только если цена отличается от последней записанной.
+    """
+    if not points:
+        return
+    async with _transaction() as db:
+        await db.executemany(
+            "INSERT OR REPLACE INTO price_history (store, product_id, ts, price) SELECT ?1, ?2, ?3, ?4 "
+            "WHERE ?4 IS NOT (SELECT price FROM price_history WHERE store = ?1 AND product_id = ?2 "
+            "ORDER BY ts DESC LIMIT 1)",
+            [(store, str(product_id), int(ts), _to_kopecks(price)) for store, product_id, ts, price in points]
+        )
+
+async def downsample_price_history(raw_days: int, retention_days: int):
+    """
+    Сворачивает точки старше raw_days в дневные min/max и удаляет дневные
+    агрегаты старше retention_days. Последняя точка товара не сворачивается:
+    от неё продолжается run-length и берётся цена на начало окна.
+    """
+    now = int(time.time())
+    cutoff = now - raw_days * _DAY
+    old_points = (
+        "FROM price_history WHERE ts < ? AND ts < (SELECT MAX(l.ts) FROM price_history l "
+        "WHERE l.store = price_history.store AND l.product_id = price_history.product_id)"
+    )
+    async with _transaction() as db:
+        cursor = await db.execute(f"SELECT store, product_id, ts, price {old_points} ORDER BY store, product_id, ts",
+                                  (cutoff,))
+        rows = await cursor.fetchall()
+        daily = []
+        for (store, product_id, day), group in groupby(rows, key=lambda r: (r[0], r[1], r[2] // _DAY * _DAY)):
+            prices = [row[3] for row in group]
+            daily.append((store, product_id, day, min(prices), max(prices), prices[-1]))
+        await db.executemany(
+            "INSERT INTO price_history_daily (store, product_id, day, min_price, max_price, last_price) "
+            "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (store, product_id, day) DO UPDATE SET "
+            "min_price = MIN(min_price, excluded.min_price), max_price = MAX(max_price, excluded.max_price), "
+            "last_price = excluded.last_price",
+            daily
+        )
+        await db.execute(f"DELETE {old_points}", (cutoff,))
+        await db.execute("DELETE FROM price_history_daily WHERE day < ?", (now - retention_days * _DAY,))
+    if rows:
+        logging.info(f"История цен: {len(rows)} точек свёрнуто в {len(daily)} дневных записей.")
+
+# Цена на начало окна: последняя точка до него, а если её уже свернули — последняя цена дня
+_CARRIED_PRICE_SQL = (
+    "COALESCE("
+    "(SELECT price FROM price_history h WHERE h.store = w.store AND h.product_id = w.product_id AND h.ts < :since "
+    "ORDER BY h.ts DESC LIMIT 1), "
+    "(SELECT last_price FROM price_history_daily d WHERE d.store = w.store AND d.product_id = w.product_id "
+    "AND d.day < :since ORDER BY d.day DESC LIMIT 1))"
+)
+
+def _window_points_sql(wanted_sql: str) -> str:
+    """CTE points(store, product_id, lo, hi): все цены товаров из wanted за окно начиная с :since."""
+    return (
+        f"WITH wanted(store, product_id) AS ({wanted_sql}), "
+        "points(store, product_id, lo, hi) AS ("
+        "SELECT h.store, h.product_id, h.price, h.price FROM price_history h "
+        "JOIN wanted w ON h.store = w.store AND h.product_id = w.product_id WHERE h.ts >= :since "
+        "UNION ALL "
+        "SELECT d.store, d.product_id, d.min_price, d.max_price FROM price_history_daily d "
+        "JOIN wanted w ON d.store = w.store AND d.product_id = w.product_id WHERE d.day >= :since "
+        "UNION ALL "
+        f"SELECT w.store, w.product_id, {_CARRIED_PRICE_SQL}, {_CARRIED_PRICE_SQL} FROM wanted w) "
+    )
+
+def _wanted_items(items) -> tuple[list, dict, str]:
+    """Уникальные пары (store, product_id), параметры и VALUES-список для CTE wanted."""
+    items = list(dict.fromkeys((store, str(product_id)) for store, product_id in items))
+    params, values = {}, []
+    for i, (store, product_id) in enumerate(items):
+        params[f"s{i}"], params[f"p{i}"] = store, product_id
+        values.append(f"(:s{i}, :p{i})")
+    return items, params, "VALUES " + ", ".join(values)
+
+async def get_price_stats(items, days: int, recent: int) -> dict:
+    """
+    Статистика цен пачки товаров тремя запросами, а не по запросу на товар.
+    items: пары (store, product_id). Возвращает {(store, product_id): {...}}:
+    min/max/avg за последние days дней, last — последняя известная цена,
+    recent — до recent последних изменений цены от старых к новым (в рублях).
+    """
+    items, params, wanted = _wanted_items(items)
+    if not items:
+        return {}
+    params["since"] = int(time.time()) - days * _DAY
+    rows = await _fetchall(
+        _window_points_sql(wanted)
+        + "SELECT store, product_id, MIN(lo), MAX(hi), AVG((lo + hi) / 2.0), COUNT(lo) FROM points "
+          "GROUP BY store, product_id HAVING COUNT(lo) > 0",
+        params
+    )
+    stats = {
+        (store, product_id): {"min": _to_rubles(low), "max": _to_rubles(high), "avg": _to_rubles(int(avg)),
+                              "points": count, "last": None, "recent": []}
+        for store, product_id, low, high, avg, count in rows
+    }
+    # Последние изменения берутся по первичному ключу (store, product_id, ts)
+    params["recent"] = recent
+    recent_rows = await _fetchall(
+        f"WITH wanted(store, product_id) AS ({wanted}) "
+        "SELECT store, product_id, price FROM ("
+        "SELECT h.store, h.product_id, h.ts, h.price, "
+        "ROW_NUMBER() OVER (PARTITION BY h.store, h.product_id ORDER BY h.ts DESC) AS n "
+        "FROM price_history h JOIN wanted w ON h.store = w.store AND h.product_id = w.product_id) "
+        "WHERE n <= :recent ORDER BY store, product_id, ts",
+        params
+    )
+    for store, product_id, price in recent_rows:
+        item = stats.get((store, product_id))
+        if item is not None:
+            item["recent"].append(_to_rubles(price))
+            item["last"] = _to_rubles(price)
+    return stats
 
-async def update_tracking_in_db(user_id, product_id, new_price, last_check):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def get_lowest_prices(items, days: int) -> dict:
+    """
+    Минимальная цена за последние days дней для пачки товаров одним запросом.
+    items: пары (store, product_id). Возвращает {(store, product_id): (min_price, points)}.
+    """
+    items, params, wanted = _wanted_items(items)
+    if not items:
+        return {}
+    params["since"] = int(time.time()) - days * _DAY
+    rows = await _fetchall(
+        _window_points_sql(wanted)
+        + "SELECT store, product_id, MIN(lo), COUNT(lo) FROM points GROUP BY store, product_id HAVING COUNT(lo) > 0",
+        params
+    )
+    return {(store, product_id): (_to_rubles(low), count) for store, product_id, low, count in rows}
+
+# Кэш file_id картинок товаров
+async def get_photo_file_id(image_url) -> str | None:
+    rows = await _fetchall("SELECT file_id FROM photo_file_ids WHERE image_url = ?", (image_url,))
+    return rows[0][0] if rows else None
+
+async def save_photo_file_id(image_url, file_id):
+    async with _transaction() as db:
         await db.execute(
-            "UPDATE tracking SET current_price = ?, last_check = ? WHERE user_id = ? AND product_id = ?",
-            (new_price, last_check, user_id, product_id)
+            "INSERT OR REPLACE INTO photo_file_ids (image_url, file_id, last_used) VALUES (?, ?, ?)",
+            (image_url, file_id, int(time.time()))
         )
-        await db.commit()
\ No newline at end of file
+
+async def delete_photo_file_id(image_url):
+    async with _transaction() as db:
+        await db.execute("DELETE FROM photo_file_ids WHERE image_url = ?", (image_url,))
+
+async def touch_and_prune_photo_file_ids(used: dict, max_entries: int, max_age: int):
+    """
+    used: {image_url: время последнего использования}. Записывает время использования,
+    удаляет записи старше max_age и самые давно использованные сверх max_entries.
+    """
+    async with _transaction() as db:
+        await db.executemany("UPDATE photo_file_ids SET last_used = MAX(last_used, ?) WHERE image_url = ?",
+                             [(int(ts), url) for url, ts in used.items()])
+        await db.execute("DELETE FROM photo_file_ids WHERE last_used < ?", (int(time.time()) - max_age,))
+        await db.execute(
+            "DELETE FROM photo_file_ids WHERE image_url IN "
+            "(SELECT image_url FROM photo_file_ids ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (max_entries,)
+        )
+
+# Состояния диалогов (FSM). data и bucket — компактный JSON.
+async def get_fsm_record(chat, user, max_age: int):
+    """(state, data, bucket) диалога или None, если его нет или он простаивает дольше max_age."""
+    rows = await _fetchall(
+        "SELECT state, data, bucket FROM fsm_states WHERE chat = ? AND user = ? AND updated_at >= ?",
+        (chat, user, int(time.time()) - max_age)
+    )
+    return rows[0] if rows else None
+
+async def save_fsm_records(records: dict, max_age: int):
+    """
+    records: {(chat, user): (state, data, bucket) или None — удалить}.
+    Записывает пачку одной транзакцией и удаляет диалоги, простаивающие дольше max_age.
+    """
+    now = int(time.time())
+    upserts = [(chat, user, *record, now) for (chat, user), record in records.items() if record is not None]
+    deletes = [key for key, record in records.items() if record is None]
+    async with _transaction() as db:
+        await db.executemany(
+            "INSERT OR REPLACE INTO fsm_states (chat, user, state, data, bucket, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            upserts
+        )
+        await db.executemany("DELETE FROM fsm_states WHERE chat = ? AND user = ?", deletes)
+        await db.execute("DELETE FROM fsm_states WHERE updated_at < ?", (now - max_age,))
+
+# Сессии поиска. items — компактный JSON упакованных товаров.
+async def save_search_session(session_id, user_id, query, page_size, ranked, items, ttl: int):
+    """Сохраняет сессию и заодно удаляет истёкшие."""
+    now = int(time.time())
+    async with _transaction() as db:
+        await db.execute("DELETE FROM search_sessions WHERE expires_at < ?", (now,))
+        await db.execute(
+            "INSERT OR REPLACE INTO search_sessions (id, user_id, query, page_size, ranked, items, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (session_id, user_id, query, page_size, int(ranked), items, now + ttl)
+        )
+
+async def get_search_session(session_id):
+    """(user_id, query, page_size, ranked, items, expires_at) или None, если сессии нет или она истекла."""
+    rows = await _fetchall(
+        "SELECT user_id, query, page_size, ranked, items, expires_at FROM search_sessions "
+        "WHERE id = ? AND expires_at >= ?",
+        (session_id, int(time.time()))
+    )
+    return rows[0] if rows else None
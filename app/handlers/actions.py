@@ -1,26 +1,63 @@
 import asyncio
+import heapq
 import logging
 import math
-from datetime import datetime
+import time
 
 from aiogram import types, Dispatcher
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.exceptions import BadRequest
 
-from app.keyboards import get_product_keyboard, get_main_menu, get_search_menu
+from app.keyboards import (
+    get_product_keyboard, get_main_menu, get_search_menu, get_tracking_store_menu, get_results_keyboard,
+    set_favorite_button, get_page_keyboard,
+)
 from app.services.ozon_parser import OzonParser
 from app.services.wildberries_parser import WildberriesParser
+from app.services.throttle import CircuitOpenError
+from app.services.fair_scheduler import ScrapersBusyError
+from app.services.parser_workers import ParserWorkerError
+from app.services.send_queue import send_queue
+from app.services.file_id_cache import photo_file_ids
+from app.services.search_sessions import search_sessions
 from app import database as db
-from app.config import ITEMS_PER_SEARCH
+from app.config import (
+    ITEMS_PER_SEARCH, SEARCH_RESULTS_LIMIT, PRODUCT_URL_TEMPLATES, FAVORITE_MAX_AGE, PRICE_LOW_WINDOW_DAYS,
+    PRICE_RECENT_POINTS,
+    BEST_TOP_K, BEST_CANDIDATES, BEST_PREVIEW_INTERVAL, BEST_MAX_COUNT,
+)
+
+MEDIA_GROUP_MIN, MEDIA_GROUP_MAX = 2, 10  # ограничения sendMediaGroup
+# Ответы Bot API, после которых сохранённый file_id больше не годится
+STALE_FILE_ID_ERRORS = ('wrong file identifier', 'failed to get http url content')
+
+STORE_NAMES = {'ozon': 'Ozon', 'wb': 'Wildberries'}
+# Магазин временно недоступен (предохранитель, переполненная очередь, упавший воркер) — у ошибок есть user_message
+UNAVAILABLE_ERRORS = (CircuitOpenError, ScrapersBusyError, ParserWorkerError)
 
 class UserStates(StatesGroup):
     search_query = State()
     track_price_article = State()
     track_price_amount = State()
 
-async def _send_product_card(message: types.Message, product_data: dict, rank: int = None):
-    is_favorite = await db.is_favorite_in_db(message.from_user.id, str(product_data['article']))
+def _store_code(product: dict) -> str:
+    return 'wb' if 'Wildberries' in product['store'] else 'ozon'
+
+async def _lowest_price_articles(products: list) -> set[str]:
+    """Артикулы, чья текущая цена — минимальная за PRICE_LOW_WINDOW_DAYS дней (по истории цен, без парсинга)."""
+    lows = await db.get_lowest_prices([(_store_code(p), p['article']) for p in products], PRICE_LOW_WINDOW_DAYS)
+    result = set()
+    for product in products:
+        price = product.get('price_with_card') or product.get('price')
+        low, points = lows.get((_store_code(product), str(product['article'])), (None, 0))
+        # Одна точка — это и есть текущая цена, сравнивать не с чем
+        if price and points >= 2 and price <= low:
+            result.add(str(product['article']))
+    return result
+
+def _card_text(product_data: dict, rank: int = None, is_lowest: bool = False) -> str:
     rank_text = f"🏆 <b>Топ #{rank}</b>\n" if rank else ""
     store_text = f"Магазин: {product_data['store']}\n\n"
     text = f"{rank_text}<b>{product_data['name']}</b>\n{store_text}"
@@ -36,6 +73,7 @@ async def _send_product_card(message: types.Message, product_data: dict, rank: i
         else:
             text += f"💰 Цена: {int(price)} ₽\n"
     else: text += "Нет в наличии\n"
+    if is_lowest: text += f"🔥 Самая низкая цена за {PRICE_LOW_WINDOW_DAYS} дней\n"
 
     rating = product_data.get('rating', 0)
     reviews_count = product_data.get('reviews_count', 0)
@@ -44,25 +82,122 @@ async def _send_product_card(message: types.Message, product_data: dict, rank: i
 
     purchases = product_data.get('purchases_count', 0)
     if purchases > 0: text += f"📈 Покупок: >{purchases:,}".replace(",", " ")
+    return text.strip()
+
+def _store_name_for_kb(product_data: dict) -> str:
+    return product_data['store'].replace(' ', '').replace('🔵', '').replace('🍓', '')
+
+async def _send_product_card(message: types.Message, product_data: dict, rank: int = None, is_favorite: bool = None,
+                             is_lowest: bool = False):
+    if is_favorite is None:
+        is_favorite = await db.is_favorite_in_db(message.from_user.id, str(product_data['article']))
+    text = _card_text(product_data, rank, is_lowest)
+    keyboard = get_product_keyboard(product_data['url'], _store_name_for_kb(product_data), str(product_data['article']), is_favorite)
+    if product_data.get('image_url') and await _send_product_photo(message, product_data['image_url'], text, keyboard):
+        return
+    await send_queue.send(message.chat.id, message.answer, text, reply_markup=keyboard)
+
+def _is_stale_file_id_error(error: Exception) -> bool:
+    return isinstance(error, BadRequest) and any(text in str(error).lower() for text in STALE_FILE_ID_ERRORS)
 
-    store_name_for_kb = product_data['store'].replace(' ', '').replace('🔵', '').replace('🍓', '')
-    if product_data.get('image_url'):
+async def _send_product_photo(message: types.Message, image_url: str, caption: str, keyboard) -> bool:
+    """Отправляет карточку с фото: по сохранённому file_id, а если его нет — по URL. False — фото не ушло."""
+    file_id = await photo_file_ids.get(image_url)
+    if file_id:
         try:
-            await message.answer_photo(
-                product_data['image_url'], caption=text.strip(),
-                reply_markup=get_product_keyboard(
-                    product_data['url'], store_name_for_kb, str(product_data['article']), is_favorite
-                ))
-        except Exception:
-            await message.answer(
-                text.strip(), reply_markup=get_product_keyboard(
-                    product_data['url'], store_name_for_kb, str(product_data['article']), is_favorite
-                ))
+            await send_queue.send(message.chat.id, message.answer_photo, file_id, caption=caption, reply_markup=keyboard)
+            return True
+        except Exception as e:
+            if not _is_stale_file_id_error(e):
+                # Сетевая ошибка, лимит, длинная подпись — file_id ни при чём, и загрузка по URL сейчас тоже не пройдёт
+                logging.warning(f"Не удалось отправить фото {image_url} по file_id: {e}")
+                return False
+            logging.warning(f"file_id для {image_url} не принят Telegram: {e}")
+            await photo_file_ids.invalidate(image_url)
+    try:
+        sent = await send_queue.send(message.chat.id, message.answer_photo, image_url, caption=caption, reply_markup=keyboard)
+    except Exception:
+        return False
+    if sent.photo:
+        await photo_file_ids.put(image_url, sent.photo[-1].file_id)
+    return True
+
+async def _send_media_group(message: types.Message, products: list, favorite_ids: set, lowest: set,
+                            ranked: bool, start: int = 1) -> bool:
+    """
+    Отправляет товары с картинками одним альбомом (sendMediaGroup), затем одно
+    сообщение с компактной клавиатурой на все товары. False — альбом не ушёл.
+    """
+    media, uploaded_urls, cached_urls = [], [], []
+    for i, product in enumerate(products, start):
+        if not product.get('image_url'):
+            continue
+        caption = _card_text(product, i if ranked else None, str(product['article']) in lowest)
+        if not ranked:
+            caption = f"<b>#{i}</b> {caption}"
+        file_id = await photo_file_ids.get(product['image_url'])
+        media.append(types.InputMediaPhoto(file_id or product['image_url'], caption=caption))
+        uploaded_urls.append(None if file_id else product['image_url'])
+        if file_id:
+            cached_urls.append(product['image_url'])
+    try:
+        sent = await send_queue.send(message.chat.id, message.answer_media_group, media)
+    except Exception as e:
+        # Одна битая картинка роняет весь альбом — тогда отправим карточки по одной
+        logging.warning(f"Не удалось отправить альбом результатов: {e}")
+        if _is_stale_file_id_error(e):
+            # Telegram не говорит, какой из file_id устарел, — забываем все из альбома,
+            # карточки по одной загрузят картинки заново и сохранят новые file_id
+            for image_url in cached_urls:
+                await photo_file_ids.invalidate(image_url)
+        return False
+    for image_url, sent_message in zip(uploaded_urls, sent):
+        if image_url and sent_message.photo:
+            await photo_file_ids.put(image_url, sent_message.photo[-1].file_id)
+
+    lines = []
+    for i, product in enumerate(products, start):
+        if product.get('image_url'):
+            price = product.get('price_with_card') or product.get('price')
+            lines.append(f"{i}. {product['name']} — {f'{int(price)} ₽' if price else 'нет в наличии'}")
+        else:
+            # Товар без картинки не попал в альбом — покажем его карточку целиком
+            lines.append(_card_text(product, i if ranked else None, str(product['article']) in lowest))
+    keyboard = get_results_keyboard([
+        (i, p['url'], _store_name_for_kb(p), str(p['article']), str(p['article']) in favorite_ids)
+        for i, p in enumerate(products, start)
+    ])
+    await send_queue.send(message.chat.id, message.answer, "\n\n".join(lines), reply_markup=keyboard,
+                          disable_web_page_preview=True)
+    return True
+
+async def _send_product_cards(message: types.Message, products: list, ranked: bool = False, start: int = 1,
+                              user_id: int = None):
+    """
+    Выдача результатов поиска: избранное и история цен — по одному запросу на всю пачку.
+    start — номер первого товара (для страниц выдачи), user_id — чьё избранное отмечать.
+    """
+    user_id = user_id or message.from_user.id
+    favorite_ids = await db.get_favorite_ids(user_id, [p['article'] for p in products])
+    lowest = await _lowest_price_articles(products)
+    with_photo = sum(1 for p in products if p.get('image_url'))
+    if MEDIA_GROUP_MIN <= with_photo and len(products) <= MEDIA_GROUP_MAX:
+        if await _send_media_group(message, products, favorite_ids, lowest, ranked, start):
+            return
+    for i, product in enumerate(products, start):
+        article = str(product['article'])
+        await _send_product_card(message, product, rank=i if ranked else None, is_favorite=article in favorite_ids,
+                                 is_lowest=article in lowest)
+
+async def _show_search_page(message: types.Message, user_id: int, session_id: str, session, page: int):
+    """Страница выдачи из сохранённой сессии поиска и сообщение с навигацией."""
+    await _send_product_cards(message, session.page(page), ranked=session.ranked,
+                              start=(page - 1) * session.page_size + 1, user_id=user_id)
+    if session.pages > 1:
+        await message.answer(f"📄 «{session.query}»: страница {page} из {session.pages}",
+                             reply_markup=get_page_keyboard(session_id, page, session.pages))
     else:
-        await message.answer(
-            text.strip(), reply_markup=get_product_keyboard(
-                product_data['url'], store_name_for_kb, str(product_data['article']), is_favorite
-            ))
+        await message.answer("Поиск завершен.", reply_markup=get_main_menu())
 
 def _calculate_score(product: dict) -> float:
     price = product.get('price', 0)
@@ -77,6 +212,104 @@ def _calculate_score(product: dict) -> float:
     rating_score = rating * 10
     return (price_score*w_price) + (reviews_score*w_reviews) + (purchases_score*w_purchases) + (rating_score*w_rating)
 
+async def _search_store(parser, query: str, count: int, store: str, unavailable: list) -> list:
+    """Поиск в одном магазине для режима «лучшее»: недоступный магазин не срывает весь поиск."""
+    try:
+        return await parser.search_products(query, count=count)
+    except UNAVAILABLE_ERRORS as e:
+        logging.warning(f"Поиск в {STORE_NAMES[store]} пропущен: {e}")
+        unavailable.append(STORE_NAMES[store])
+        return []
+
+def _score_upper_bound(tile: dict) -> float:
+    """
+    Оценка сверху для неполной плитки. Без цены её нет: вклад 1000 / price
+    не ограничен, и такая плитка загружается всегда. Цена с плитки — текущая,
+    а страница товара не даёт цену ниже. Неизвестный рейтинг считается равным 5,
+    неизвестное число отзывов и покупок — BEST_MAX_COUNT.
+    """
+    if not tile.get('price'):
+        return math.inf
+    bound = dict(tile)
+    bound['rating'] = tile.get('rating') or 5
+    bound['reviews_count'] = tile.get('reviews_count') or BEST_MAX_COUNT
+    bound['purchases_count'] = tile.get('purchases_count') or BEST_MAX_COUNT
+    return _calculate_score(bound)
+
+def _preview_text(ranked: list, waiting: list) -> str:
+    lines = [f"🏆 <b>Предварительный топ-{BEST_TOP_K}</b>", ""]
+    for i, product in enumerate(ranked, 1):
+        price = product.get('price_with_card') or product.get('price')
+        lines.append(f"{i}. {product['store']} {product['name']} — {f'{int(price)} ₽' if price else 'нет в наличии'}")
+    lines += ["", f"⏳ Ещё ищу на {' и '.join(waiting)}..."]
+    return "\n".join(lines)
+
+async def _stream_best_search(message: types.Message, status_msg: types.Message, ozon_parser: OzonParser,
+                              wb_parser: WildberriesParser) -> tuple[list, list]:
+    """
+    Режим «лучшее» потоком: товары оцениваются по мере поступления, текущий
+    топ-K показывается в статусном сообщении (обычно сначала WB, затем Ozon
+    уточняет рейтинг). Неполные плитки Ozon не дозагружаются, если даже по
+    оценке сверху не попадут в топ. Возвращает (все товары по убыванию оценки,
+    недоступные магазины).
+    """
+    query = message.text
+    candidates, unavailable = [], []
+    events = asyncio.Queue()
+
+    def top() -> list:
+        return heapq.nlargest(BEST_TOP_K, candidates, key=lambda p: p['score'])
+
+    def worth_fetching(tile: dict) -> bool:
+        ranked = top()
+        return len(ranked) < BEST_TOP_K or _score_upper_bound(tile) > ranked[-1]['score']
+
+    # События очереди: (магазин, новые товары, магазин закончил поиск)
+    async def produce_wb():
+        products = []
+        try:
+            products = await _search_store(wb_parser, query, BEST_CANDIDATES, 'wb', unavailable)
+        except Exception as e:
+            logging.error(f"Ошибка поиска WB в режиме «лучшее»: {e}")
+        finally:
+            await events.put(('wb', products, True))
+
+    async def produce_ozon():
+        try:
+            async for product in ozon_parser.stream_search_products(query, BEST_CANDIDATES, worth_fetching):
+                await events.put(('ozon', [product], False))
+        except UNAVAILABLE_ERRORS as e:
+            logging.warning(f"Поиск в Ozon пропущен: {e}")
+            unavailable.append(STORE_NAMES['ozon'])
+        except Exception as e:
+            logging.error(f"Ошибка поиска Ozon в режиме «лучшее»: {e}")
+        finally:
+            await events.put(('ozon', [], True))
+
+    producers = [asyncio.create_task(produce_wb()), asyncio.create_task(produce_ozon())]
+    waiting = {'ozon', 'wb'}
+    shown, last_preview = None, 0.0
+    try:
+        while waiting:
+            store, products, finished = await events.get()
+            if finished:
+                waiting.discard(store)
+            for product in products:
+                product['score'] = _calculate_score(product)
+                candidates.append(product)
+            ranked = top()
+            keys = [(p['store'], p['article']) for p in ranked]
+            if waiting and keys != shown and time.monotonic() - last_preview >= BEST_PREVIEW_INTERVAL:
+                try:
+                    await status_msg.edit_text(_preview_text(ranked, [STORE_NAMES[s] for s in sorted(waiting)]))
+                    shown, last_preview = keys, time.monotonic()
+                except Exception as e:
+                    logging.warning(f"Не удалось обновить предварительный топ: {e}")
+    finally:
+        for task in producers:
+            task.cancel()
+    return sorted(candidates, key=lambda p: p['score'], reverse=True), unavailable
+
 async def go_to_search(callback: types.CallbackQuery, state: FSMContext):
     await state.finish()
     await callback.message.edit_text("Выберите, где будем искать товары:", reply_markup=get_search_menu())
@@ -97,92 +330,115 @@ async def handle_search_query(message: types.Message, state: FSMContext, ozon_pa
     status_msg = await message.answer(f"Ищу \"{message.text}\"...")
     try:
         if store == 'best':
-            await status_msg.edit_text("Ищу товары на Ozon и WB... Это может занять до минуты.")
-           
-            ozon_articles_task = ozon_parser.search_and_get_articles(message.text, count=20)
-            wb_products_task = wb_parser.search_products(message.text, count=20)
-            ozon_articles, wb_products = await asyncio.gather(ozon_articles_task, wb_products_task)
-            
-           
-            ozon_products_tasks = [ozon_parser.get_product_data(article) for article in ozon_articles]
-            ozon_results = await asyncio.gather(*ozon_products_tasks)
-            ozon_products = [p for p in ozon_results if p]
+            await status_msg.edit_text("Ищу товары на Ozon и WB... Первые результаты появятся здесь.")
+            ranked_products, unavailable = await _stream_best_search(message, status_msg, ozon_parser, wb_parser)
+            if unavailable:
+                await message.answer(f"⏳ {', '.join(unavailable)} временно ограничил доступ — показываю результаты без него.")
 
-            all_products = ozon_products + wb_products
-            if not all_products:
+            if not ranked_products:
                 await status_msg.edit_text("😕 Ничего не найдено ни в одном магазине.", reply_markup=get_main_menu())
                 return
-            
-            for p in all_products: p['score'] = _calculate_score(p)
-            sorted_products = sorted(all_products, key=lambda p: p['score'], reverse=True)
-            
-            await status_msg.edit_text("🏆 <b>Топ-5 лучших товаров по цене и популярности:</b>")
-            for i, product in enumerate(sorted_products[:5], 1):
-                await _send_product_card(message, product, rank=i)
-        
-        
+
+            await status_msg.edit_text(f"🏆 <b>Топ-{BEST_TOP_K} лучших товаров по цене и популярности:</b>")
+            # Весь рейтинг остаётся в сессии: следующие страницы показываются без повторного парсинга
+            session_id, session = await search_sessions.create(message.from_user.id, message.text, ranked_products,
+                                                               BEST_TOP_K, ranked=True)
+
         else:
             products = []
             if store == 'ozon':
-                
-                articles = await ozon_parser.search_and_get_articles(message.text, count=ITEMS_PER_SEARCH)
-                if articles:
-                   
-                    tasks = [ozon_parser.get_product_data(article) for article in articles]
-                    results = await asyncio.gather(*tasks)
-                    products = [p for p in results if p]
+                products = await ozon_parser.search_products(message.text, count=SEARCH_RESULTS_LIMIT)
             
             elif store == 'wb':
                 
-                products = await wb_parser.search_products(message.text, count=ITEMS_PER_SEARCH)
+                products = await wb_parser.search_products(message.text, count=SEARCH_RESULTS_LIMIT)
 
             await status_msg.delete()
             if not products:
                 await message.answer("😕 К сожалению, ничего не найдено.", reply_markup=get_main_menu())
                 return
             
-            for product in products:
-                await _send_product_card(message, product)
-        
-        await message.answer("Поиск завершен.", reply_markup=get_main_menu())
+            session_id, session = await search_sessions.create(message.from_user.id, message.text, products, ITEMS_PER_SEARCH)
+
+        await _show_search_page(message, message.from_user.id, session_id, session, 1)
 
+    except UNAVAILABLE_ERRORS as e:
+        await status_msg.edit_text(e.user_message, reply_markup=get_main_menu())
     except Exception as e:
         logging.error(f"Критическая ошибка при поиске '{message.text}': {e}")
         await status_msg.edit_text("😔 Произошла непредвиденная ошибка при поиске.", reply_markup=get_main_menu())
 
 
 
+async def show_search_page(callback: types.CallbackQuery):
+    _, session_id, page = callback.data.split('_')
+    session = await search_sessions.get(session_id)
+    if session is None:
+        await callback.answer("⌛ Результаты поиска устарели. Повторите поиск.", show_alert=True)
+        return
+    if session.user_id != callback.from_user.id:
+        await callback.answer("Это результаты чужого поиска.", show_alert=True)
+        return
+    await callback.answer()
+    # Новая страница появится ниже — старая навигация больше не нужна
+    await callback.message.delete()
+    await _show_search_page(callback.message, callback.from_user.id, session_id, session,
+                            min(max(int(page), 1), session.pages))
+
+async def noop(callback: types.CallbackQuery):
+    await callback.answer()
+
 async def add_favorite(callback: types.CallbackQuery, ozon_parser: OzonParser, wb_parser: WildberriesParser):
     try:
         _, _, store_code, article = callback.data.split('_')
-        if store_code == "WB":
-            await callback.answer("Добавление в избранное для WB в разработке.", show_alert=True)
-            return
+        store = 'wb' if store_code == "WB" else 'ozon'
+        parser = wb_parser if store == 'wb' else ozon_parser
 
-        product_data = await ozon_parser.get_product_data(article)
+        # Пользователь только что видел этот товар в выдаче — данные из кэша подойдут
+        product_data = await parser.get_product_data(article, max_age=FAVORITE_MAX_AGE, require_detail=False)
 
         if not product_data:
             await callback.answer("❌ Не удалось обновить данные о товаре", show_alert=True)
             return
         
         price = product_data.get('price_with_card') or product_data.get('price')
-        await db.add_favorite_to_db(callback.from_user.id, article, product_data['name'], int(price))
-        await callback.message.edit_reply_markup(reply_markup=get_product_keyboard(
-            product_data['url'], store_code, article, is_favorite=True
-        ))
+        await db.add_favorite_to_db(callback.from_user.id, article, product_data['name'], int(price), store)
+        keyboard = callback.message.reply_markup
+        if keyboard and set_favorite_button(keyboard, callback.data, store_code, article, is_favorite=True):
+            await callback.message.edit_reply_markup(reply_markup=keyboard)
         await callback.answer("✅ Добавлено в избранное!", show_alert=True)
+    except UNAVAILABLE_ERRORS as e:
+        await callback.answer(e.user_message, show_alert=True)
     except Exception as e:
         logging.error(f"Ошибка добавления в избранное: {e}")
         await callback.answer("Произошла ошибка", show_alert=True)
 
+def _favorite_button_store(keyboard: InlineKeyboardMarkup, callback_data: str) -> str | None:
+    """Магазин товара по ссылке рядом с кнопкой избранного; None — это элемент списка избранного."""
+    url = None
+    for row in keyboard.inline_keyboard:
+        for button in row:
+            if button.callback_data == callback_data and button.text.startswith("🗑️"):
+                return None
+        row_urls = [b.url for b in row if b.url]
+        if any(b.callback_data == callback_data for b in row) and row_urls:
+            url = row_urls[0]
+            break
+        url = url or next(iter(row_urls), None)
+    if url is None:
+        return None
+    return 'Ozon' if 'ozon' in url else 'WB'
+
 async def delete_favorite(callback: types.CallbackQuery):
     article = callback.data.split('_')[-1]
     await db.remove_favorite_from_db(callback.from_user.id, article)
-    if callback.message.photo or '<b>' in callback.message.text:
+    keyboard = callback.message.reply_markup
+    # Карточки и списки результатов переключают кнопку на месте, элемент списка избранного удаляется
+    store_name = _favorite_button_store(keyboard, callback.data) if keyboard else None
+    if store_name:
         try:
-            url = callback.message.reply_markup.inline_keyboard[0][0].url
-            store_name = 'Ozon' if 'ozon' in url else 'WB'
-            await callback.message.edit_reply_markup(reply_markup=get_product_keyboard(url, store_name, article, is_favorite=False))
+            set_favorite_button(keyboard, callback.data, store_name, article, is_favorite=False)
+            await callback.message.edit_reply_markup(reply_markup=keyboard)
         except Exception: await callback.message.delete()
     else: await callback.message.delete()
     await callback.answer("🗑️ Удалено из избранного", show_alert=True)
@@ -194,35 +450,51 @@ async def show_favorites(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer("⭐ Ваш список избранного пуст", show_alert=True)
         return
     await callback.message.edit_text("⭐ Ваше избранное:")
-    for product_id, name, price in favorites:
+    for product_id, name, price, store in favorites:
         text = f"<b>{name}</b>\nЦена: {price} ₽"
         keyboard = InlineKeyboardMarkup().add(
-            InlineKeyboardButton("🛍 Открыть", url=f"https://ozon.ru/product/{product_id}/"),
+            InlineKeyboardButton("🛍 Открыть", url=PRODUCT_URL_TEMPLATES[store].format(product_id)),
             InlineKeyboardButton("🗑️ Удалить", callback_data=f"del_fav_{product_id}")
         )
-        await callback.message.answer(text, reply_markup=keyboard)
+        await send_queue.send(callback.message.chat.id, callback.message.answer, text, reply_markup=keyboard)
     await callback.message.answer("Главное меню", reply_markup=get_main_menu())
     await callback.answer()
 
 async def start_price_tracking(callback: types.CallbackQuery, state: FSMContext):
+    await state.finish()
+    await callback.message.edit_text("📊 В каком магазине отслеживать цену?", reply_markup=get_tracking_store_menu())
+    await callback.answer()
+
+async def choose_tracking_store(callback: types.CallbackQuery, state: FSMContext):
+    store = callback.data.split('_')[-1]
+    await state.update_data(store=store)
     await state.set_state(UserStates.track_price_article)
-    await callback.message.edit_text("📊 Введите артикул товара <b>Ozon</b> для отслеживания:")
+    await callback.message.edit_text(f"📊 Введите артикул товара <b>{STORE_NAMES[store]}</b> для отслеживания:")
     await callback.answer()
 
-async def process_tracking_article(message: types.Message, state: FSMContext, ozon_parser: OzonParser):
+async def process_tracking_article(message: types.Message, state: FSMContext, ozon_parser: OzonParser, wb_parser: WildberriesParser):
     if not message.text.isdigit():
         await message.reply("⚠️ Артикул должен содержать только цифры!")
         return
     article = message.text
-    status_msg = await message.answer(f"Проверяю товар Ozon {article}...")
-    product_data = await ozon_parser.get_product_data(article)
+    store = (await state.get_data()).get('store', 'ozon')
+    parser = wb_parser if store == 'wb' else ozon_parser
+    status_msg = await message.answer(f"Проверяю товар {STORE_NAMES[store]} {article}...")
+    try:
+        product_data = await parser.get_product_data(article)
+    except UNAVAILABLE_ERRORS as e:
+        await status_msg.edit_text(e.user_message, reply_markup=get_main_menu())
+        await state.finish()
+        return
     if not product_data:
-        await status_msg.edit_text(f"❌ Не удалось найти товар на Ozon.", reply_markup=get_main_menu())
+        await status_msg.edit_text(f"❌ Не удалось найти товар на {STORE_NAMES[store]}.", reply_markup=get_main_menu())
         await state.finish()
         return
-    await state.update_data(product=product_data)
-    await state.set_state(UserStates.track_price_amount)
     price = product_data.get('price_with_card') or product_data.get('price')
+    # В состоянии диалога — только то, что нужно для сохранения отслеживания
+    await state.update_data(product={'article': str(product_data['article']), 'name': product_data['name'],
+                                     'price': int(price)})
+    await state.set_state(UserStates.track_price_amount)
     await status_msg.edit_text(
         f"Товар: <b>{product_data['name']}</b>\nТекущая цена: {int(price)} ₽\n\n"
         "Введите желаемую цену (например, 1500)."
@@ -235,10 +507,9 @@ async def process_tracking_price(message: types.Message, state: FSMContext):
     desired_price = int(message.text)
     user_data = await state.get_data()
     product = user_data.get('product')
-    price = product.get('price_with_card') or product.get('price')
     await db.add_tracking_to_db(
         message.from_user.id, product['article'], product['name'],
-        desired_price, int(price), datetime.now().isoformat()
+        desired_price, product['price'], user_data.get('store', 'ozon')
     )
     await state.finish()
     await message.answer("✅ Отслеживание установлено!", reply_markup=get_main_menu())
@@ -249,15 +520,22 @@ async def show_tracking(callback: types.CallbackQuery, state: FSMContext):
     if not tracked_items:
         await callback.answer("📊 У вас нет отслеживаемых товаров", show_alert=True)
         return
-    await callback.message.edit_text("📊 Ваши отслеживаемые товары (Ozon):")
-    for product_id, name, desired_price, current_price in tracked_items:
+    await callback.message.edit_text("📊 Ваши отслеживаемые товары:")
+    price_stats = await db.get_price_stats([(store, product_id) for product_id, _, _, _, store in tracked_items],
+                                           PRICE_LOW_WINDOW_DAYS, PRICE_RECENT_POINTS)
+    for product_id, name, desired_price, current_price, store in tracked_items:
         status = "✅ Цена достигнута!" if current_price <= desired_price else "⏳ Ожидаем"
         text = f"<b>{name}</b>\nЖелаемая цена: {desired_price} ₽\nТекущая цена: {current_price} ₽\nСтатус: {status}"
+        stats = price_stats.get((store, str(product_id)))
+        if stats and stats['points'] >= 2:
+            text += f"\n📉 За {PRICE_LOW_WINDOW_DAYS} дней: от {stats['min']} до {stats['max']} ₽"
+        if stats and len(stats['recent']) >= 2:
+            text += f"\n🕑 Последние цены: {' → '.join(str(price) for price in stats['recent'])} ₽"
         keyboard = InlineKeyboardMarkup().add(
-            InlineKeyboardButton("🛍 Открыть", url=f"https://ozon.ru/product/{product_id}/"),
+            InlineKeyboardButton("🛍 Открыть", url=PRODUCT_URL_TEMPLATES[store].format(product_id)),
             InlineKeyboardButton("❌ Прекратить", callback_data=f"del_track_{product_id}")
         )
-        await callback.message.answer(text, reply_markup=keyboard)
+        await send_queue.send(callback.message.chat.id, callback.message.answer, text, reply_markup=keyboard)
     await callback.message.answer("Главное меню", reply_markup=get_main_menu())
     await callback.answer()
 
@@ -271,10 +549,13 @@ def register_handlers_actions(dp: Dispatcher):
     dp.register_callback_query_handler(go_to_search, lambda c: c.data == 'go_to_search', state='*')
     dp.register_callback_query_handler(start_search, lambda c: c.data.startswith('search_'), state='*')
     dp.register_message_handler(handle_search_query, state=UserStates.search_query)
+    dp.register_callback_query_handler(show_search_page, lambda c: c.data.startswith('page_'), state='*')
+    dp.register_callback_query_handler(noop, lambda c: c.data == 'noop', state='*')
     dp.register_callback_query_handler(add_favorite, lambda c: c.data.startswith('add_fav_'))
     dp.register_callback_query_handler(delete_favorite, lambda c: c.data.startswith('del_fav_'))
     dp.register_callback_query_handler(show_favorites, lambda c: c.data == 'show_favorites', state='*')
     dp.register_callback_query_handler(start_price_tracking, lambda c: c.data == 'track_price', state='*')
+    dp.register_callback_query_handler(choose_tracking_store, lambda c: c.data.startswith('track_store_'), state='*')
     dp.register_message_handler(process_tracking_article, state=UserStates.track_price_article)
     dp.register_message_handler(process_tracking_price, state=UserStates.track_price_amount)
     dp.register_callback_query_handler(show_tracking, lambda c: c.data == 'show_tracking', state='*')
@@ -16,6 +16,13 @@ def get_search_menu():
         InlineKeyboardButton("⬅️ Назад в главное меню", callback_data="main_menu")
     )
 
+def get_tracking_store_menu():
+    return InlineKeyboardMarkup(row_width=2).add(
+        InlineKeyboardButton("🔵 Ozon", callback_data="track_store_ozon"),
+        InlineKeyboardButton("🍓 Wildberries", callback_data="track_store_wb"),
+        InlineKeyboardButton("⬅️ Назад в главное меню", callback_data="main_menu")
+    )
+
 def get_product_keyboard(product_url: str, store_name: str, article: str, is_favorite: bool = False):
     keyboard = InlineKeyboardMarkup(row_width=2)
     keyboard.add(InlineKeyboardButton(f"🛍 Открыть в {store_name}", url=product_url))
@@ -26,4 +33,51 @@ def get_product_keyboard(product_url: str, store_name: str, article: str, is_fav
     
     keyboard.add(InlineKeyboardButton(fav_text, callback_data=fav_callback))
     keyboard.add(InlineKeyboardButton("🔄 Новый поиск", callback_data="go_to_search"))
-    return keyboard
\ No newline at end of file
+    return keyboard
+def get_results_keyboard(items):
+    """
+    Компактная клавиатура к альбому результатов: по строке на товар.
+    items: кортежи (номер, url, store_name, article, is_favorite).
+    """
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    for number, product_url, store_name, article, is_favorite in items:
+        store_code = 'Ozon' if 'Ozon' in store_name else 'WB'
+        keyboard.row(
+            InlineKeyboardButton(f"🛍 #{number} {store_name}", url=product_url),
+            InlineKeyboardButton(f"❤️ #{number}" if is_favorite else f"⭐ #{number}",
+                                 callback_data=f"del_fav_{article}" if is_favorite else f"add_fav_{store_code}_{article}"),
+        )
+    keyboard.add(InlineKeyboardButton("🔄 Новый поиск", callback_data="go_to_search"))
+    return keyboard
+
+def set_favorite_button(keyboard: InlineKeyboardMarkup, callback_data: str, store_name: str, article: str,
+                        is_favorite: bool) -> bool:
+    """
+    Переключает кнопку избранного (найденную по callback_data) прямо в клавиатуре
+    сообщения — и в карточке товара, и в компактном списке. False — кнопки нет.
+    """
+    store_code = 'Ozon' if 'Ozon' in store_name else 'WB'
+    for row in keyboard.inline_keyboard:
+        for button in row:
+            if button.callback_data != callback_data:
+                continue
+            if button.text in ("⭐ В избранное", "❤️ В избранном"):
+                button.text = "❤️ В избранном" if is_favorite else "⭐ В избранное"
+            else:
+                button.text = ("❤️ " if is_favorite else "⭐ ") + button.text.split(' ', 1)[-1]
+            button.callback_data = f"del_fav_{article}" if is_favorite else f"add_fav_{store_code}_{article}"
+            return True
+    return False
+
+def get_page_keyboard(session_id: str, page: int, pages: int):
+    """Навигация по страницам результатов поиска и возврат в меню."""
+    keyboard = InlineKeyboardMarkup(row_width=3)
+    nav = []
+    if page > 1:
+        nav.append(InlineKeyboardButton("◀", callback_data=f"page_{session_id}_{page - 1}"))
+    nav.append(InlineKeyboardButton(f"{page}/{pages}", callback_data="noop"))
+    if page < pages:
+        nav.append(InlineKeyboardButton("▶", callback_data=f"page_{session_id}_{page + 1}"))
+    keyboard.row(*nav)
+    keyboard.add(InlineKeyboardButton("⬅️ Назад в главное меню", callback_data="main_menu"))
+    return keyboard
@@ -0,0 +1,42 @@
+"""
+Отправка записанных обновлений Telegram на локальный вебхук для отладки:
+
+    python -m app.replay_updates updates.json [http://127.0.0.1:8080/webhook]
+
+Файл — ответ getUpdates ({"ok": true, "result": [...]}), JSON-массив
+обновлений или по одному обновлению в строке.
+"""
+import asyncio
+import json
+import sys
+
+import aiohttp
+
+from app.config import WEBAPP_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+from app.webhook import SECRET_HEADER
+
+
+def load_updates(path: str) -> list[dict]:
+    with open(path, encoding='utf-8') as f:
+        text = f.read().strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, list):
+        return data
+    return data['result'] if 'result' in data else [data]
+
+
+async def replay(path: str, url: str):
+    updates = load_updates(path)
+    async with aiohttp.ClientSession(headers={SECRET_HEADER: WEBHOOK_SECRET}) as session:
+        for update in updates:
+            async with session.post(url, json=update) as response:
+                print(f"update_id={update.get('update_id')}: HTTP {response.status}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    asyncio.run(replay(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else f"http://127.0.0.1:{WEBAPP_PORT}{WEBHOOK_PATH}"))
@@ -0,0 +1,77 @@
+import pickle
+import re
+import time
+from collections import OrderedDict
+
+from app.config import SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_MAX_BYTES
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r'\s+', ' ', query.strip().lower().replace('ё', 'е'))
+
+
+class TTLCache:
+    """
+    Ограниченный кэш со сроком жизни записей и вытеснением по LRU.
+    Размер ограничивается числом записей и (приблизительно) объёмом в байтах.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int = 0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self.total_bytes -= size
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def set(self, key, value, ttl: float):
+        size = len(pickle.dumps(value)) if self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            return
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (time.monotonic() + ttl, size, value)
+        self.total_bytes += size
+        while self._data and (len(self._data) > self.max_entries
+                              or (self.max_bytes and self.total_bytes > self.max_bytes)):
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        if key not in self._data:
+            return default
+        value = self._data[key][2]
+        self._remove(key)
+        return value
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data), "bytes": self.total_bytes,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Общий кэш результатов поиска для обоих магазинов.
+# Ключ: (магазин, нормализованный запрос, количество).
+search_cache = TTLCache(SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_MAX_BYTES)
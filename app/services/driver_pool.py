@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException, TimeoutException
+from selenium.webdriver.chrome.options import Options
+
+
+def _build_options() -> Options:
+    options = Options()
+    options.add_argument('--headless')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--disable-blink-features=AutomationControlled')
+    options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+    options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    return options
+
+
+class _DriverSlot:
+    def __init__(self, index: int):
+        self.index = index
+        self.driver = None
+        self.pages_served = 0
+
+
+class DriverPool:
+    """
+    Пул «прогретых» драйверов Chrome. Каждый вызов получает свободный драйвер,
+    драйверы проверяются перед выдачей и пересоздаются после заданного числа
+    страниц или при превышении порога памяти.
+
+    Все блокирующие вызовы Selenium выполняются в отдельном пуле потоков,
+    поэтому цикл событий aiogram не замирает, пока Ozon рендерит страницу.
+    """
+
+    def __init__(self, size: int, max_pages: int, max_memory_mb: int):
+        self.size = max(1, size)
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self._all_slots = [_DriverSlot(i) for i in range(self.size)]
+        self._slots = asyncio.Queue()
+        for slot in self._all_slots:
+            self._slots.put_nowait(slot)
+        self.executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="ozon-selenium")
+
+    def _create_driver(self, slot: _DriverSlot):
+        try:
+            slot.driver = webdriver.Chrome(options=_build_options())
+            slot.pages_served = 0
+            logging.info(f"Драйвер Selenium #{slot.index} для Ozon успешно инициализирован.")
+        except Exception as e:
+            logging.error(f"Не удалось инициализировать драйвер Ozon #{slot.index}: {e}")
+            slot.driver = None
+
+    def _close_driver(self, slot: _DriverSlot):
+        if slot.driver is None:
+            return
+        try:
+            slot.driver.quit()
+        except Exception as e:
+            logging.warning(f"Ошибка при остановке драйвера Ozon #{slot.index}: {e}")
+        slot.driver = None
+
+    def _is_healthy(self, slot: _DriverSlot) -> bool:
+        try:
+            _ = slot.driver.window_handles
+            return True
+        except WebDriverException:
+            return False
+
+    def _memory_usage_mb(self, slot: _DriverSlot) -> float:
+        """Суммарный RSS chromedriver и всех его потомков: браузера, рендереров, GPU-процесса."""
+        try:
+            root = psutil.Process(slot.driver.service.process.pid)
+            processes = [root, *root.children(recursive=True)]
+        except (AttributeError, psutil.Error):
+            return 0.0
+        used = 0
+        for process in processes:
+            try:
+                used += process.memory_info().rss
+            except psutil.Error:  # процесс успел завершиться
+                continue
+        return used / (1024 * 1024)
+
+    def _needs_recycle(self, slot: _DriverSlot) -> bool:
+        if self.max_pages and slot.pages_served >= self.max_pages:
+            logging.info(f"Драйвер Ozon #{slot.index} обработал {slot.pages_served} страниц. Пересоздаём...")
+            return True
+        if self.max_memory_mb:
+            memory_mb = self._memory_usage_mb(slot)
+            if memory_mb > self.max_memory_mb:
+                logging.info(f"Драйвер Ozon #{slot.index} занимает {memory_mb:.0f} МБ. Пересоздаём...")
+                return True
+        return False
+
+    def _prepare(self, slot: _DriverSlot):
+        if slot.driver is not None and not self._is_healthy(slot):
+            logging.warning(f"Драйвер Ozon #{slot.index} не отвечает. Перезапускаем...")
+            self._close_driver(slot)
+        if slot.driver is None:
+            self._create_driver(slot)
+        if slot.driver is None:
+            raise ConnectionError("Не удалось запустить драйвер Ozon.")
+
+    def _after_use(self, slot: _DriverSlot, broken: bool):
+        slot.pages_served += 1
+        if broken or self._needs_recycle(slot):
+            self._close_driver(slot)
+
+    def _run_in_slot(self, slot: _DriverSlot, fn, args):
+        broken = False
+        try:
+            self._prepare(slot)
+            return fn(slot.driver, *args)
+        except TimeoutException:
+            raise
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            if slot.driver is not None:
+                self._after_use(slot, broken)
+
+    def _warm_up(self, slot: _DriverSlot):
+        if slot.driver is None:
+            self._create_driver(slot)
+
+    async def _in_slot(self, target, *args):
+        """Выполняет target(slot, *args) в пуле потоков, удерживая свободный слот."""
+        slot = await self._slots.get()
+        loop = asyncio.get_running_loop()
+        future = self.executor.submit(target, slot, *args)
+        # Слот возвращается в пул только когда поток реально закончил работу,
+        # даже если ожидающую корутину отменили раньше.
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._slots.put_nowait, slot))
+        return await asyncio.wrap_future(future)
+
+    async def start(self):
+        # Прогрев берёт слоты из той же очереди, что и запросы: первый запрос
+        # не может начать работу с драйвером, который в этот момент ещё создаётся.
+        # Слот, занятый запросом, прогревать незачем — драйвер создаст _prepare.
+        await asyncio.gather(*(self._in_slot(self._warm_up) for _ in range(self.size)))
+
+    async def run(self, fn, *args):
+        """Выполняет fn(driver, *args) на свободном драйвере в пуле потоков."""
+        return await self._in_slot(self._run_in_slot, fn, args)
+
+    def _quit_sync(self):
+        for slot in self._all_slots:
+            self._close_driver(slot)
+
+    async def quit(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._quit_sync)
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,158 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from app.config import (
+    SCRAPE_CLASS_WEIGHTS, SCRAPE_USER_MAX_CONCURRENCY, SCRAPE_BACKGROUND_MAX_SLOTS, SCRAPE_MAX_WAIT,
+)
+
+INTERACTIVE, BACKGROUND = 'interactive', 'background'
+
+# Кто и зачем запрашивает парсинг. Middleware бота выставляет пользователя,
+# планировщик проверки цен — класс BACKGROUND; задачи наследуют контекст.
+current_user: ContextVar = ContextVar('scrape_user', default=None)
+current_class: ContextVar = ContextVar('scrape_class', default=INTERACTIVE)
+
+
+class ScrapersBusyError(Exception):
+    """Задание слишком долго ждало свободного браузера и снято с очереди."""
+
+    def __init__(self, job_class: str, waited: float):
+        self.job_class = job_class
+        self.waited = waited
+        super().__init__(f"Задание класса {job_class} ждало браузер {waited:.0f} с и было отклонено.")
+
+    @property
+    def user_message(self) -> str:
+        return "⏳ Сейчас слишком много запросов к магазину. Попробуйте через минуту."
+
+
+class _Job:
+    def __init__(self, user, job_class: str, finish: float, seq: int):
+        self.user = user
+        self.job_class = job_class
+        self.finish = finish
+        self.seq = seq
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+
+class FairScheduler:
+    """
+    Взвешенная справедливая очередь (WFQ) перед ограниченным числом браузеров.
+
+    Поток — пара (класс, пользователь). Каждое задание получает виртуальное
+    время завершения: max(V, последнее у потока) + 1 / вес класса; выдаётся
+    задание с наименьшим временем среди тех, чей пользователь не превысил
+    SCRAPE_USER_MAX_CONCURRENCY. Поэтому 20 плиток одного поиска не задерживают
+    одиночный запрос другого пользователя, а фоновая проверка цен никогда не
+    занимает больше SCRAPE_BACKGROUND_MAX_SLOTS браузеров и не берёт последний
+    свободный, если его ждёт интерактивное задание. Задание, прождавшее
+    дольше SCRAPE_MAX_WAIT своего класса, получает ScrapersBusyError.
+    """
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = capacity
+        self._queue: list[_Job] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish = {}  # (класс, пользователь) -> время завершения последнего задания потока
+        self._running = 0
+        self._running_by_user = Counter()
+        self._running_by_class = Counter()
+        self.granted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+
+    def _class_limit(self, job_class: str) -> int:
+        return SCRAPE_BACKGROUND_MAX_SLOTS if job_class == BACKGROUND else self.capacity
+
+    def _within_limits(self, job: _Job) -> bool:
+        if self._running_by_class[job.job_class] >= self._class_limit(job.job_class):
+            return False
+        return job.user is None or self._running_by_user[job.user] < SCRAPE_USER_MAX_CONCURRENCY
+
+    def _eligible(self, job: _Job) -> bool:
+        if not self._within_limits(job):
+            return False
+        # Последний свободный браузер фоновому заданию не отдаётся, пока его ждёт человек
+        # (важно при одном браузере, где SCRAPE_BACKGROUND_MAX_SLOTS его не бережёт)
+        if job.job_class == BACKGROUND and self._running + 1 >= self.capacity:
+            return not any(other.job_class != BACKGROUND and self._within_limits(other) for other in self._queue)
+        return True
+
+    def _dispatch(self):
+        self._queue = [job for job in self._queue if not job.future.done()]
+        while self._running < self.capacity:
+            candidates = [job for job in self._queue if self._eligible(job)]
+            if not candidates:
+                break
+            job = min(candidates, key=lambda j: (j.finish, j.seq))
+            self._queue.remove(job)
+            self._virtual_time = max(self._virtual_time, job.finish)
+            self._grant(job)
+            job.future.set_result(None)
+        if not self._queue:
+            # Очередь пуста — старые метки потоков больше не нужны
+            self._last_finish.clear()
+
+    def _grant(self, job: _Job):
+        self._running += 1
+        self._running_by_user[job.user] += 1
+        self._running_by_class[job.job_class] += 1
+        self.granted += 1
+        self.total_wait += time.monotonic() - job.enqueued_at
+
+    def _release(self, job: _Job):
+        self._running -= 1
+        self._running_by_user[job.user] -= 1
+        if not self._running_by_user[job.user]:
+            del self._running_by_user[job.user]
+        self._running_by_class[job.job_class] -= 1
+        self._dispatch()
+
+    async def _acquire(self, user, job_class: str) -> _Job:
+        flow = (job_class, user)
+        finish = max(self._virtual_time, self._last_finish.get(flow, 0.0)) + 1 / SCRAPE_CLASS_WEIGHTS[job_class]
+        self._last_finish[flow] = finish
+        job = _Job(user, job_class, finish, next(self._seq))
+        self._queue.append(job)
+        self._dispatch()
+        if job.future.done():
+            return job
+        try:
+            await asyncio.wait_for(job.future, SCRAPE_MAX_WAIT[job_class])
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            waited = time.monotonic() - job.enqueued_at
+            logging.warning(f"[{self.name}] Очередь переполнена: {job_class} от {user} отклонено после {waited:.0f} с.")
+            raise ScrapersBusyError(job_class, waited) from None
+        except asyncio.CancelledError:
+            # Слот могли выдать в тот же момент, когда ожидающего отменили
+            if job.future.done() and not job.future.cancelled():
+                self._release(job)
+            raise
+        return job
+
+    @asynccontextmanager
+    async def slot(self, user=None, job_class: str | None = None):
+        """Держит один браузер на время блока; по умолчанию пользователь и класс берутся из контекста."""
+        job = await self._acquire(current_user.get() if user is None else user,
+                                  job_class or current_class.get())
+        try:
+            yield
+        finally:
+            self._release(job)
+
+    def stats(self) -> dict:
+        return {
+            "queued": dict(Counter(job.job_class for job in self._queue if not job.future.done())),
+            "running": self._running, "running_by_class": dict(self._running_by_class),
+            "granted": self.granted, "rejected": self.rejected,
+            "avg_wait": self.total_wait / self.granted if self.granted else 0.0,
+        }
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import time
+
+from app import database as db
+from app.config import (
+    PHOTO_FILE_ID_MAX_ENTRIES, PHOTO_FILE_ID_MEMORY_ENTRIES, PHOTO_FILE_ID_TTL, PHOTO_FILE_ID_FLUSH_INTERVAL,
+)
+from app.services.cache import TTLCache
+
+
+class PhotoFileIdCache:
+    """
+    Соответствие «URL картинки товара -> file_id в Telegram».
+    После первой загрузки картинка отправляется по file_id, и Telegram
+    не скачивает её заново с Ozon/WB. Горячие записи лежат в памяти, все — в БД;
+    время использования пишется в БД пачкой, там же вытесняются старые записи (LRU).
+    """
+
+    def __init__(self):
+        self._memory = TTLCache(PHOTO_FILE_ID_MEMORY_ENTRIES)
+        self._used = {}  # image_url -> unix-время последнего использования, ещё не записанное в БД
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, image_url: str) -> str | None:
+        file_id = self._memory.get(image_url)
+        if file_id is None:
+            file_id = await db.get_photo_file_id(image_url)
+            if file_id is not None:
+                self._memory.set(image_url, file_id, PHOTO_FILE_ID_TTL)
+        if file_id is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used[image_url] = time.time()
+        return file_id
+
+    async def put(self, image_url: str, file_id: str):
+        self._memory.set(image_url, file_id, PHOTO_FILE_ID_TTL)
+        await db.save_photo_file_id(image_url, file_id)
+
+    async def invalidate(self, image_url: str):
+        """file_id перестал приниматься Telegram — в следующий раз загрузим по URL."""
+        self._memory.pop(image_url)
+        self._used.pop(image_url, None)
+        await db.delete_photo_file_id(image_url)
+
+    async def flush(self):
+        used, self._used = self._used, {}
+        try:
+            await db.touch_and_prune_photo_file_ids(used, PHOTO_FILE_ID_MAX_ENTRIES, PHOTO_FILE_ID_TTL)
+        except Exception:
+            # Не теряем отметки: более новые из self._used важнее возвращаемых
+            self._used = {**used, **self._used}
+            raise
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(PHOTO_FILE_ID_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Ошибка обслуживания кэша file_id: {e}")
+
+    def stats(self) -> dict:
+        return {"memory_entries": len(self._memory), "hits": self.hits, "misses": self.misses}
+
+
+photo_file_ids = PhotoFileIdCache()
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import typing
+from collections import namedtuple
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from app import database as db
+from app.config import FSM_STATE_TTL, FSM_MEMORY_ENTRIES, FSM_MEMORY_TTL, FSM_FLUSH_INTERVAL, FSM_FLUSH_BATCH
+from app.services.cache import TTLCache
+
+# data и bucket хранятся строкой JSON: так запись компактна в памяти,
+# а json.loads при чтении заодно отдаёт обработчику независимую копию.
+_Record = namedtuple('_Record', 'state data bucket')
+_EMPTY = _Record(None, '{}', '{}')
+_MISSING = object()
+
+
+def _dumps(value: dict | None) -> str:
+    return json.dumps(value or {}, ensure_ascii=False, separators=(',', ':'))
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в SQLite вместо MemoryStorage.
+
+    В памяти держатся только недавно активные диалоги (LRU, FSM_MEMORY_TTL
+    простоя), остальные читаются из БД по запросу. Изменения копятся и пишутся
+    одной транзакцией раз в FSM_FLUSH_INTERVAL (или сразу, если их набралось
+    FSM_FLUSH_BATCH), поэтому перезапуск теряет не больше нескольких секунд.
+    Диалоги, не менявшиеся дольше FSM_STATE_TTL, забываются.
+
+    shared=True — для нескольких процессов на одной БД (вебхук с воркерами):
+    обновления одного пользователя могут прийти в разные процессы, поэтому
+    состояние всегда читается из БД, а изменения записываются сразу.
+    """
+
+    def __init__(self, shared: bool = False):
+        self.shared = shared
+        self._memory = TTLCache(FSM_MEMORY_ENTRIES)
+        self._dirty = {}  # (chat, user) -> _Record или None (удалить), ещё не записанные в БД
+        self._flushing = {}  # пачка, которая пишется в БД прямо сейчас
+        self._flush_lock = asyncio.Lock()
+        self.flushes = 0
+        self.db_reads = 0
+
+    def _key(self, chat, user) -> tuple:
+        chat, user = self.check_address(chat=chat, user=user)
+        return int(chat), int(user)
+
+    def _pending(self, key):
+        for pending in (self._dirty, self._flushing):
+            if key in pending:
+                return pending[key] or _EMPTY
+        return _MISSING
+
+    async def _load(self, key) -> _Record:
+        record = self._pending(key)
+        if record is not _MISSING:
+            return record
+        record = None if self.shared else self._memory.get(key)
+        if record is not None:
+            return record
+        self.db_reads += 1
+        row = await db.get_fsm_record(*key, FSM_STATE_TTL)
+        # Пока шёл запрос, диалог могли изменить — свежая версия важнее прочитанной
+        record = self._pending(key)
+        if record is _MISSING:
+            record = _Record(*row) if row else _EMPTY
+            if not self.shared:
+                self._memory.set(key, record, FSM_MEMORY_TTL)
+        return record
+
+    async def _update(self, chat, user, **changes):
+        key = self._key(chat, user)
+        current = await self._load(key)
+        record = current._replace(**changes)
+        if record == current:
+            return
+        self._dirty[key] = None if record == _EMPTY else record
+        if self.shared:
+            await self.flush()
+            return
+        self._memory.set(key, record, FSM_MEMORY_TTL)
+        if len(self._dirty) >= FSM_FLUSH_BATCH and not self._flush_lock.locked():
+            asyncio.create_task(self.flush())
+
+    async def get_state(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        state = (await self._load(self._key(chat, user))).state
+        return self.resolve_state(default) if state is None else state
+
+    async def get_data(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        return json.loads((await self._load(self._key(chat, user))).data)
+
+    async def set_state(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                        state: typing.Optional[typing.AnyStr] = None):
+        await self._update(chat, user, state=self.resolve_state(state))
+
+    async def set_data(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        await self._update(chat, user, data=_dumps(data))
+
+    async def update_data(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        merged = await self.get_data(chat=chat, user=user)
+        merged.update(data or {}, **kwargs)
+        await self.set_data(chat=chat, user=user, data=merged)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        return json.loads((await self._load(self._key(chat, user))).bucket)
+
+    async def set_bucket(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        await self._update(chat, user, bucket=_dumps(bucket))
+
+    async def update_bucket(self, *, chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None, bucket: typing.Dict = None, **kwargs):
+        merged = await self.get_bucket(chat=chat, user=user)
+        merged.update(bucket or {}, **kwargs)
+        await self.set_bucket(chat=chat, user=user, bucket=merged)
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            self._flushing, self._dirty = self._dirty, {}
+            try:
+                await db.save_fsm_records(self._flushing, FSM_STATE_TTL)
+                self.flushes += 1
+            except Exception:
+                # Не теряем изменения: более новые из _dirty важнее возвращаемых
+                self._dirty = {**self._flushing, **self._dirty}
+                raise
+            finally:
+                self._flushing = {}
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(FSM_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Ошибка сохранения состояний диалогов: {e}")
+
+    async def close(self):
+        await self.flush()
+
+    async def wait_closed(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"memory_entries": len(self._memory), "dirty": len(self._dirty),
+                "flushes": self.flushes, "db_reads": self.db_reads}
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import random
+
+import aiohttp
+from yarl import URL
+
+from app.config import (
+    HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_RETRIES, HTTP_RETRY_BASE_DELAY,
+)
+
+from app.services.throttle import throttle
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BLOCK_STATUSES = RETRY_STATUSES | {403}
+
+
+def create_session(headers: dict) -> aiohttp.ClientSession:
+    """Долгоживущая сессия с ограниченным пулом соединений, DNS-кэшем и keep-alive."""
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    timeout = aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+    return aiohttp.ClientSession(headers=headers, connector=connector, timeout=timeout)
+
+
+def _retry_delay(attempt: int, retry_after: str | None = None) -> float:
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    # Экспоненциальная задержка с «полным» джиттером
+    return random.uniform(0, HTTP_RETRY_BASE_DELAY * (2 ** attempt))
+
+
+async def get_json(session: aiohttp.ClientSession, url: str, **kwargs) -> dict | None:
+    """
+    GET-запрос с повторами при 429/5xx и сетевых ошибках.
+    Возвращает разобранный JSON или None, если все попытки исчерпаны.
+    Каждая попытка проходит через троттлинг хоста; если его предохранитель
+    разомкнут, пробрасывается CircuitOpenError.
+    """
+    host = URL(url).host
+    for attempt in range(HTTP_RETRIES + 1):
+        await throttle.before_request(host)
+        try:
+            async with session.get(url, **kwargs) as response:
+                if response.status in BLOCK_STATUSES:
+                    throttle.record_failure(host, 'status')
+                else:
+                    throttle.record_success(host)
+                if response.status == 200:
+                    return await response.json(content_type=None)
+                if response.status not in RETRY_STATUSES:
+                    logging.error(f"Ошибка запроса {url}: статус {response.status}")
+                    return None
+                delay = _retry_delay(attempt, response.headers.get('Retry-After'))
+                logging.warning(f"Статус {response.status} от {host}, повтор через {delay:.1f} с.")
+        except asyncio.TimeoutError:
+            throttle.record_failure(host, 'timeout')
+            delay = _retry_delay(attempt)
+            logging.warning(f"Тайм-аут при запросе {url}, повтор через {delay:.1f} с.")
+        except aiohttp.ClientError as e:
+            throttle.record_failure(host, 'error')
+            delay = _retry_delay(attempt)
+            logging.warning(f"Сетевая ошибка при запросе {url}: {e!r}, повтор через {delay:.1f} с.")
+        if attempt < HTTP_RETRIES:
+            await asyncio.sleep(delay)
+    logging.error(f"Запрос {url} не удался после {HTTP_RETRIES + 1} попыток.")
+    return None
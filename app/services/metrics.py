@@ -0,0 +1,49 @@
+import asyncio
+import json
+import logging
+
+from app.config import METRICS_LOG_INTERVAL
+from app.services.cache import search_cache
+from app.services.product_cache import product_cache
+from app.services.throttle import throttle
+
+
+class Metrics:
+    """
+    Сводка статистики сервисов процесса: источники регистрируются при запуске,
+    снимок раз в METRICS_LOG_INTERVAL пишется в лог одной строкой JSON
+    и отдаётся по METRICS_PATH на сервере вебхука.
+    """
+
+    def __init__(self):
+        self._sources = {}
+
+    def register(self, name: str, stats):
+        """stats — функция без аргументов, возвращающая словарь, например send_queue.stats."""
+        self._sources[name] = stats
+
+    def snapshot(self) -> dict:
+        result = {}
+        for name, stats in self._sources.items():
+            try:
+                result[name] = stats()
+            except Exception as e:
+                result[name] = {"error": repr(e)}
+        return result
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(METRICS_LOG_INTERVAL)
+            logging.info(f"Метрики: {json.dumps(self.snapshot(), ensure_ascii=False, default=str)}")
+
+
+metrics = Metrics()
+
+
+def register_parser_metrics(ozon_parser):
+    """Статистика процесса, где работают парсеры: бота без PARSER_WORKERS или воркера парсинга."""
+    metrics.register('throttle', throttle.stats)
+    metrics.register('ozon_scheduler', ozon_parser.scheduler.stats)
+    metrics.register('ozon_flights', ozon_parser.flights.stats)
+    metrics.register('search_cache', search_cache.stats)
+    metrics.register('product_cache', product_cache.stats)
@@ -0,0 +1,166 @@
+import asyncio
+import html
+import json
+import logging
+import re
+
+import aiohttp
+
+from app.services.http_session import create_session, BLOCK_STATUSES
+from app.services.throttle import throttle, CircuitOpenError
+
+# Отдельный ключ троттлинга: антибот режет «голый» HTTP раньше, чем браузер,
+# и размыкание этого предохранителя лишь переводит запросы на Selenium.
+THROTTLE_HOST = "www.ozon.ru/http"
+
+_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'ru-RU,ru;q=0.9',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+}
+
+_LD_JSON_RE = re.compile(r'<script[^>]+type="application/ld\+json"[^>]*>(.*?)</script>', re.S)
+_STATE_RE = re.compile(r'id="state-(\w+)-[^"]*"[^>]*?data-state=\'([^\']*)\'', re.S)
+_CHALLENGE_MARKERS = ('Antibot Challenge', 'challenge-form', 'captcha', 'Доступ ограничен')
+
+
+class ProductNotFoundError(LookupError):
+    """Ozon ответил 404: товара с таким артикулом нет, браузер не поможет."""
+
+
+def _parse_price(value) -> int:
+    if value is None: return 0
+    digits = "".join(filter(str.isdigit, str(value).split('.')[0]))
+    return int(digits) if digits else 0
+
+
+def is_challenge_page(page: str) -> bool:
+    return any(marker in page for marker in _CHALLENGE_MARKERS)
+
+
+def _extract_states(page: str) -> dict:
+    """Собирает JSON-состояния виджетов вида <div id="state-webPrice-..." data-state='...'>."""
+    states = {}
+    for widget, raw in _STATE_RE.findall(page):
+        try:
+            states.setdefault(widget, json.loads(html.unescape(raw)))
+        except ValueError:
+            continue
+    return states
+
+
+def _extract_ld_product(page: str) -> dict:
+    for raw in _LD_JSON_RE.findall(page):
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            continue
+        if isinstance(data, dict) and data.get('@type') == 'Product':
+            return data
+    return {}
+
+
+def parse_product_html(page: str, article: str) -> dict | None:
+    """
+    Разбирает встроенное JSON-состояние страницы товара Ozon в тот же словарь,
+    что возвращает OzonParser.get_product_data. Возвращает None, если страница
+    оказалась заглушкой антибота или данных не хватает.
+    """
+    if is_challenge_page(page):
+        return None
+
+    ld = _extract_ld_product(page)
+    states = _extract_states(page)
+    web_price = states.get('webPrice', {})
+
+    name = (ld.get('name') or states.get('webProductHeading', {}).get('title') or '').strip()
+    if not name:
+        return None
+
+    offers = ld.get('offers') or {}
+    if isinstance(offers, list):
+        offers = offers[0] if offers else {}
+    price = _parse_price(web_price.get('price') or offers.get('price'))
+    price_with_card = _parse_price(web_price.get('cardPrice')) or price
+    if not price and not web_price and not offers:
+        return None
+
+    aggregate = ld.get('aggregateRating') or {}
+    score = states.get('webReviewProductScore', {})
+    try:
+        rating = float(aggregate.get('ratingValue') or score.get('totalScore') or 0)
+    except (TypeError, ValueError):
+        rating = 0.0
+    reviews_count = _parse_price(aggregate.get('reviewCount') or score.get('reviewsCount'))
+
+    image_url = ld.get('image')
+    if isinstance(image_url, list):
+        image_url = image_url[0] if image_url else None
+    if not image_url:
+        gallery = states.get('webGallery', {})
+        image_url = gallery.get('coverImage') or next((i.get('src') for i in gallery.get('images', [])), None)
+
+    url = f"https://www.ozon.ru/product/{article}/"
+    return {
+        "store": "🔵 Ozon", "name": name, "price": price,
+        "price_with_card": price_with_card, "reviews_count": reviews_count,
+        "rating": rating,
+        "purchases_count": 0, "article": article, "url": url, "image_url": image_url,
+    }
+
+
+class OzonHttpFetcher:
+    """Быстрый путь без браузера: загружает страницу товара через aiohttp."""
+
+    def __init__(self):
+        self.session = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = create_session(_HEADERS)
+        return self.session
+
+    async def fetch_product(self, article: str) -> dict | None:
+        """None — загрузить без браузера не удалось; ProductNotFoundError — товара нет."""
+        url = f"https://www.ozon.ru/product/{article}/"
+        try:
+            await throttle.before_request(THROTTLE_HOST)
+        except CircuitOpenError:
+            return None
+        try:
+            session = await self._get_session()
+            async with session.get(url) as response:
+                if response.status == 404:
+                    # Ошибка в артикуле — не признак блокировки, предохранитель её не считает
+                    throttle.record_success(THROTTLE_HOST)
+                    raise ProductNotFoundError(article)
+                if response.status != 200:
+                    logging.info(f"Ozon HTTP: статус {response.status} для артикула {article}.")
+                    if response.status in BLOCK_STATUSES:
+                        throttle.record_failure(THROTTLE_HOST, 'status')
+                    return None
+                page = await response.text()
+        except ProductNotFoundError:
+            raise
+        except asyncio.TimeoutError:
+            logging.info(f"Ozon HTTP: тайм-аут для артикула {article}.")
+            throttle.record_failure(THROTTLE_HOST, 'timeout')
+            return None
+        except Exception as e:
+            logging.info(f"Ozon HTTP: ошибка запроса для артикула {article}: {e}")
+            throttle.record_failure(THROTTLE_HOST, 'error')
+            return None
+
+        if is_challenge_page(page):
+            logging.info(f"Ozon HTTP: получена страница антибота для артикула {article}.")
+            throttle.record_failure(THROTTLE_HOST, 'challenge')
+            return None
+        throttle.record_success(THROTTLE_HOST)
+        product = parse_product_html(page, article)
+        if product is None:
+            logging.info(f"Ozon HTTP: не удалось разобрать JSON-состояние для артикула {article}.")
+        return product
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
@@ -1,150 +1,404 @@
 import asyncio
+import inspect
 import logging
 import re
-from selenium import webdriver
-from selenium.common.exceptions import WebDriverException, NoSuchElementException, TimeoutException
-from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import NoSuchElementException, TimeoutException, WebDriverException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
+from app.config import (
+    OZON_DRIVERS_POOL_SIZE, OZON_DRIVER_MAX_PAGES, OZON_DRIVER_MAX_MEMORY_MB, SEARCH_CACHE_TTL, PRODUCT_MAX_AGE,
+)
+from app.services.cache import search_cache, normalize_query
+from app.services.product_cache import product_cache
+from app.services.single_flight import SingleFlight
+from app.services.throttle import throttle, ChallengePageError, CircuitOpenError
+from app.services.fair_scheduler import FairScheduler, ScrapersBusyError
+from app.services.driver_pool import DriverPool
+from app.services.ozon_http import OzonHttpFetcher, ProductNotFoundError, is_challenge_page
+
+THROTTLE_HOST = "www.ozon.ru"
+# Ошибки «магазин сейчас недоступен» пробрасываются наверх, чтобы показать их пользователю
+_UNAVAILABLE_ERRORS = (CircuitOpenError, ScrapersBusyError)
+
+# Возвращает «сырые» тексты карточки товара одним объектом, чтобы не делать
+# десятки отдельных запросов к chromedriver (по одному на каждый элемент).
+_EXTRACT_PRODUCT_JS = """
+const text = el => (el && (el.innerText || el.textContent) || '').trim();
+const h1 = document.querySelector('h1');
+const priceWidget = document.querySelector('div[data-widget="webPrice"]');
+const prices = priceWidget ? Array.from(priceWidget.querySelectorAll('span')).map(text) : [];
+const links = Array.from(document.querySelectorAll('a')).map(text)
+    .filter(t => /отзыв|оцен/i.test(t));
+const img = document.querySelector('div[data-widget="webGallery"] img');
+return {
+    name: text(h1),
+    prices: prices,
+    links: links,
+    srcset: img ? img.getAttribute('srcset') : null,
+    src: img ? img.getAttribute('src') : null,
+};
+"""
+
+# Собирает карточки товаров прямо со страницы поиска: название, цены,
+# рейтинг/отзывы и миниатюру — без перехода на страницу каждого товара.
+_EXTRACT_SEARCH_TILES_JS = """
+const text = el => (el && (el.innerText || el.textContent) || '').trim();
+const count = arguments[0];
+const seen = new Set();
+const tiles = [];
+for (const a of document.querySelectorAll('a[href*="/product/"]')) {
+    const m = (a.href || '').match(/\\/product\\/.*?[-\\/](\\d{9,})\\/?/);
+    if (!m || seen.has(m[1])) continue;
+    seen.add(m[1]);
+    let tile = a;
+    for (let depth = 0; depth < 6 && tile.parentElement; depth++) {
+        if (tile.querySelector('img') && /₽/.test(text(tile))) break;
+        tile = tile.parentElement;
+    }
+    const names = Array.from(tile.querySelectorAll('a[href*="/product/"]')).map(text)
+        .filter(t => t && !/₽/.test(t));
+    const nameSet = new Set(names);
+    const lines = text(tile).split('\\n').map(l => l.trim()).filter(Boolean);
+    const img = tile.querySelector('img');
+    tiles.push({
+        article: m[1],
+        name: names.sort((x, y) => y.length - x.length)[0] || '',
+        prices: lines.filter(l => /₽/.test(l)),
+        info: lines.filter(l => !/₽/.test(l) && !nameSet.has(l)).join(' • '),
+        srcset: img ? img.getAttribute('srcset') : null,
+        src: img ? img.getAttribute('src') : null,
+    });
+    if (tiles.length >= count) break;
+}
+return tiles;
+"""
+
 class OzonParser:
     def __init__(self):
-        self.driver = None
-        self.semaphore = asyncio.Semaphore(1)
-        asyncio.create_task(self._init_webdriver())
+        self.pool = DriverPool(OZON_DRIVERS_POOL_SIZE, OZON_DRIVER_MAX_PAGES, OZON_DRIVER_MAX_MEMORY_MB)
+        asyncio.create_task(self.pool.start())
+        self.http = OzonHttpFetcher()
+        self.http_hits = 0
+        self.selenium_fallbacks = 0
+        self.flights = SingleFlight("Ozon")
+        self.scheduler = FairScheduler("Ozon", OZON_DRIVERS_POOL_SIZE)
+
+    @property
+    def fallback_rate(self) -> float:
+        total = self.http_hits + self.selenium_fallbacks
+        return self.selenium_fallbacks / total if total else 0.0
+
+    def _parse_price(self, price_str: str) -> int:
+        if not price_str: return 0
+        return int("".join(filter(str.isdigit, price_str)))
+
+    def _parse_prices(self, prices_text: list[str]) -> tuple[int, int]:
+        price, price_with_card = 0, 0
+        if len(prices_text) >= 2:
+            price_with_card = self._parse_price(prices_text[0])
+            price = self._parse_price(prices_text[1])
+        elif len(prices_text) == 1:
+            price = self._parse_price(prices_text[0])
+            price_with_card = price
+        return price, price_with_card
+
+    def _parse_rating_and_reviews(self, link_texts: list[str]) -> tuple[float, int]:
+        reviews_count = 0
+        rating = 0.0
+        for link_text in link_texts:
+            if "отзыв" in link_text.lower() or "оцен" in link_text.lower():
+                # Один неразобранный текст не должен лишать товар остальных данных
+                try:
+                    rating_match = re.search(r'(\d\.\d)', link_text)
+                    if rating_match:
+                        rating = float(rating_match.group(1))
+
+                    reviews_match = re.search(r'(?<![\d.,])(\d[\d\s]*)\s*(отзыв|оцен)', link_text.lower())
+                    if reviews_match:
+                        # Ozon разделяет разряды и неразрывным, и узким пробелом
+                        reviews_count = int(re.sub(r'\s', '', reviews_match.group(1)))
+                except ValueError as e:
+                    logging.warning(f"Не удалось разобрать рейтинг/отзывы Ozon из '{link_text}': {e}")
+                    continue
 
-    async def _init_webdriver(self):
+                if reviews_count > 0:
+                    break
+        return rating, reviews_count
+
+    def _pick_image(self, srcset: str | None, src: str | None) -> str | None:
+        if srcset:
+            sources = [s.strip().split(' ') for s in srcset.split(',')]
+            best_source = max(sources, key=lambda item: int(item[1][:-1]) if len(item) == 2 and item[1].endswith('w') else 0)
+            return best_source[0]
+        return src
+
+    def _build_product(self, article: str, url: str, name: str, price: int, price_with_card: int,
+                       rating: float, reviews_count: int, image_url: str | None) -> dict:
+        return {
+            "store": "🔵 Ozon", "name": name, "price": price,
+            "price_with_card": price_with_card, "reviews_count": reviews_count,
+            "rating": rating, 
+            "purchases_count": 0, "article": article, "url": url, "image_url": image_url,
+        }
+
+    # Синхронные методы ниже выполняются в потоке пула драйверов, а не в цикле событий.
+    def _extract_product_js(self, d, article: str, url: str) -> dict | None:
+        """Собирает все поля карточки одним вызовом execute_script."""
+        try:
+            raw = d.execute_script(_EXTRACT_PRODUCT_JS)
+        except WebDriverException as e:
+            logging.warning(f"Скрипт извлечения данных Ozon не сработал для {article}: {e}")
+            return None
+        if not raw or not raw.get('name'):
+            return None
+        price, price_with_card = self._parse_prices([t for t in raw.get('prices') or [] if '₽' in t])
+        rating, reviews_count = self._parse_rating_and_reviews(raw.get('links') or [])
+        image_url = self._pick_image(raw.get('srcset'), raw.get('src'))
+        return self._build_product(article, url, raw['name'].strip(), price, price_with_card,
+                                   rating, reviews_count, image_url)
+
+    def _extract_product_elements(self, d, article: str, url: str, name: str) -> dict:
+        """Запасной путь: поэлементный обход страницы через WebDriver."""
+        price, price_with_card = 0, 0
+        try:
+            price_widget = d.find_element(by='css selector', value='div[data-widget="webPrice"]')
+            prices_text = [p.text for p in price_widget.find_elements(by='css selector', value='span') if '₽' in p.text]
+            price, price_with_card = self._parse_prices(prices_text)
+        except NoSuchElementException: pass
+
+        reviews_count = 0
+        rating = 0.0 
         try:
-            options = Options()
-            options.add_argument('--headless')
-            options.add_argument('--no-sandbox')
-            options.add_argument('--disable-dev-shm-usage')
-            options.add_argument('--disable-blink-features=AutomationControlled')
-            options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
-            options.add_experimental_option("excludeSwitches", ["enable-automation"])
-            self.driver = webdriver.Chrome(options=options)
-            logging.info("Драйвер Selenium для Ozon успешно инициализирован.")
+            all_links = d.find_elements(By.TAG_NAME, "a")
+            rating, reviews_count = self._parse_rating_and_reviews(link.text for link in all_links)
         except Exception as e:
-            logging.error(f"Не удалось инициализировать драйвер Ozon: {e}")
-            self.driver = None
+            logging.warning(f"Ошибка при парсинге отзывов/оценки Ozon: {e}")
 
-    async def _get_driver(self):
-        if self.driver is None:
-            await self._init_webdriver()
+        image_url = None
         try:
-            _ = self.driver.window_handles
-        except WebDriverException:
-            logging.warning("Драйвер Ozon не отвечает. Перезапускаем...")
-            await self._init_webdriver()
-        if self.driver is None:
-            raise ConnectionError("Не удалось запустить драйвер Ozon.")
-        return self.driver
+            img_container = d.find_element(by='css selector', value='div[data-widget="webGallery"]')
+            img_element = img_container.find_element(by='tag name', value='img')
+            srcset = img_element.get_attribute('srcset')
+            image_url = self._pick_image(srcset, None if srcset else img_element.get_attribute('src'))
+        except Exception: pass
 
-    def _parse_price(self, price_str: str) -> int:
-        if not price_str: return 0
-        return int("".join(filter(str.isdigit, price_str)))
+        return self._build_product(article, url, name, price, price_with_card, rating, reviews_count, image_url)
+
+    def _open_page(self, d, url: str):
+        d.get(url)
+        if is_challenge_page(d.title or ""):
+            raise ChallengePageError(f"Ozon показал страницу антибота: {url}")
+
+    def _scrape_product(self, d, article: str) -> dict:
+        url = f"https://www.ozon.ru/product/{article}/"
+        self._open_page(d, url)
+
+        wait = WebDriverWait(d, 10)
+        wait.until(EC.url_contains(article))
+        
+        h1_element = wait.until(EC.presence_of_element_located((By.TAG_NAME, "h1")))
+
+        product = self._extract_product_js(d, article, url)
+        if product:
+            return product
+        return self._extract_product_elements(d, article, url, h1_element.text.strip())
+
+    def _scrape_search_tiles(self, d, query: str, count: int) -> list[dict]:
+        search_url = f"https://www.ozon.ru/search/?text={query.replace(' ', '+')}&from_global=true"
+        self._open_page(d, search_url)
+
+        wait = WebDriverWait(d, 10)
+        wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, 'a[href*="/product/"]')))
 
-    async def get_product_data(self, article: str) -> dict | None:
-        async with self.semaphore:
+        products = []
+        for tile in d.execute_script(_EXTRACT_SEARCH_TILES_JS, count) or []:
+            # Неразобранная плитка пропускается, остальная выдача сохраняется
             try:
-                d = await self._get_driver()
-                url = f"https://www.ozon.ru/product/{article}/"
-                d.get(url)
-
-                wait = WebDriverWait(d, 10)
-                wait.until(EC.url_contains(article))
-                
-                h1_element = wait.until(EC.presence_of_element_located((By.TAG_NAME, "h1")))
-                name = h1_element.text.strip()
-                
-                price, price_with_card = 0, 0
-                try:
-                    price_widget = d.find_element(by='css selector', value='div[data-widget="webPrice"]')
-                    prices_text = [p.text for p in price_widget.find_elements(by='css selector', value='span') if '₽' in p.text]
-                    if len(prices_text) >= 2:
-                        price_with_card = self._parse_price(prices_text[0])
-                        price = self._parse_price(prices_text[1])
-                    elif len(prices_text) == 1:
-                        price = self._parse_price(prices_text[0])
-                        price_with_card = price
-                except NoSuchElementException: pass
-
-                reviews_count = 0
-                rating = 0.0 
-                try:
-                    all_links = d.find_elements(By.TAG_NAME, "a")
-                    for link in all_links:
-                        link_text = link.text
-                        if "отзыв" in link_text.lower() or "оцен" in link_text.lower():
-                            
-                            rating_match = re.search(r'(\d\.\d)', link_text)
-                            if rating_match:
-                                rating = float(rating_match.group(1))
-
-                            
-                            reviews_match = re.search(r'(\d[\d\s]*)\s*(отзыв|оцен)', link_text.lower())
-                            if reviews_match:
-                                reviews_count = int(reviews_match.group(1).replace(" ", ""))
-                            
-                            if reviews_count > 0: 
-                                break
-                except Exception as e:
-                    logging.warning(f"Ошибка при парсинге отзывов/оценки Ozon: {e}")
-
-                image_url = None
-                try:
-                    img_container = d.find_element(by='css selector', value='div[data-widget="webGallery"]')
-                    img_element = img_container.find_element(by='tag name', value='img')
-                    srcset = img_element.get_attribute('srcset')
-                    if srcset:
-                        sources = [s.strip().split(' ') for s in srcset.split(',')]
-                        best_source = max(sources, key=lambda item: int(item[1][:-1]) if len(item) == 2 and item[1].endswith('w') else 0)
-                        image_url = best_source[0]
-                    else:
-                        image_url = img_element.get_attribute('src')
-                except Exception: pass
-
-                return {
-                    "store": "🔵 Ozon", "name": name, "price": price,
-                    "price_with_card": price_with_card, "reviews_count": reviews_count,
-                    "rating": rating, 
-                    "purchases_count": 0, "article": article, "url": url, "image_url": image_url,
-                }
+                article = tile['article']
+                prices = tile.get('prices') or []
+                # Цена на плитке — это текущая цена, зачёркнутая идёт следом.
+                # Цена по Ozon карте на плитке не гарантирована, её даёт только страница товара.
+                price = self._parse_price(prices[0]) if prices else 0
+                rating, reviews_count = self._parse_rating_and_reviews([tile.get('info') or ''])
+                product = self._build_product(
+                    article, f"https://www.ozon.ru/product/{article}/", (tile.get('name') or '').strip(),
+                    price, None, rating, reviews_count, self._pick_image(tile.get('srcset'), tile.get('src'))
+                )
+            except (KeyError, ValueError, TypeError, IndexError) as e:
+                logging.warning(f"Пропущена плитка Ozon {tile.get('article') if isinstance(tile, dict) else tile!r}: {e}")
+                continue
+            products.append(product)
+        return products
+
+    async def get_product_data(self, article: str, max_age: float = PRODUCT_MAX_AGE,
+                               allow_stale: bool = True, require_detail: bool = True) -> dict | None:
+        """
+        Данные о товаре через общий кэш. max_age — допустимый возраст данных в секундах;
+        require_detail=False позволяет довольствоваться данными с плитки поиска.
+        """
+        product = await product_cache.get('ozon', article, self._fetch_product_data_shared, max_age,
+                                          allow_stale=allow_stale, require_detail=require_detail)
+        return dict(product) if product else None
+
+    async def _fetch_product_data_shared(self, article: str) -> dict | None:
+        return await self.flights.do(('product', str(article)), lambda: self._fetch_product_data(article))
+
+    async def _fetch_product_data(self, article: str) -> dict | None:
+        try:
+            product = await self.http.fetch_product(article)
+        except ProductNotFoundError:
+            logging.info(f"Ozon {article}: товар не найден (404).")
+            return None
+        if product:
+            self.http_hits += 1
+            return product
+
+        self.selenium_fallbacks += 1
+        logging.info(f"Ozon {article}: переход на Selenium. Доля fallback: {self.fallback_rate:.0%} "
+                     f"({self.selenium_fallbacks} из {self.http_hits + self.selenium_fallbacks}).")
+        return await self._get_product_data_selenium(article)
+
+    async def _run_in_browser(self, fn, *args):
+        """
+        Запуск парсинга в браузере: сначала троттлинг и предохранитель хоста,
+        затем очередь справедливого планировщика. Пауза троттлинга выдерживается
+        до получения браузера, чтобы он не простаивал занятым.
+        """
+        await throttle.before_request(THROTTLE_HOST)
+        async with self.scheduler.slot():
+            try:
+                result = await self.pool.run(fn, *args)
+            except ChallengePageError:
+                throttle.record_failure(THROTTLE_HOST, 'challenge')
+                raise
             except TimeoutException:
-                logging.error(f"Не удалось загрузить страницу для Ozon артикула {article} (тайм-аут).")
-                return None
-            except Exception as e:
-                logging.error(f"Ошибка при парсинге Ozon артикула {article}: {e}")
-                return None
+                throttle.record_failure(THROTTLE_HOST, 'timeout')
+                raise
+            throttle.record_success(THROTTLE_HOST)
+            return result
 
-    async def search_and_get_articles(self, query: str, count: int) -> list[str]:
-        
-        async with self.semaphore:
+    async def _get_product_data_selenium(self, article: str) -> dict | None:
+        try:
+            return await self._run_in_browser(self._scrape_product, article)
+        except _UNAVAILABLE_ERRORS:
+            raise
+        except ChallengePageError as e:
+            logging.warning(str(e))
+            return None
+        except TimeoutException:
+            logging.error(f"Не удалось загрузить страницу для Ozon артикула {article} (тайм-аут).")
+            return None
+        except Exception as e:
+            logging.error(f"Ошибка при парсинге Ozon артикула {article}: {e}")
+            return None
+
+    async def search_products(self, query: str, count: int) -> list[dict]:
+        """
+        Ищет товары и возвращает полные данные с одной страницы поиска.
+        Страница товара загружается только для плиток, из которых не удалось
+        достать название или цену.
+        """
+        cache_key = ('ozon', normalize_query(query), count)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"Результаты Ozon по запросу '{query}' взяты из кэша.")
+            return [dict(p) for p in cached]
+        products = await self.flights.do(cache_key, lambda: self._search_products_uncached(query, count, cache_key))
+        return [dict(p) for p in products]
+
+    async def _get_search_tiles(self, query: str, count: int) -> list[dict]:
+        """Плитки со страницы поиска; одновременные одинаковые запросы делят одну загрузку."""
+        async def scrape():
             try:
-                d = await self._get_driver()
-                search_url = f"https://www.ozon.ru/search/?text={query.replace(' ', '+')}&from_global=true"
-                d.get(search_url)
-                
-                wait = WebDriverWait(d, 10)
-                wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, 'a[href*="/product/"]')))
-                
-                link_elements = d.find_elements(by='css selector', value='a[href*="/product/"]')
-                unique_articles = []
-                for link in link_elements:
-                    try:
-                        href = link.get_attribute('href')
-                        article_match = re.search(r'/product/.*?[-/](\d{9,})/?', href)
-                        if article_match:
-                            article = article_match.group(1)
-                            if article not in unique_articles: unique_articles.append(article)
-                    except Exception: continue
-                return unique_articles[:count]
+                return await self._run_in_browser(self._scrape_search_tiles, query, count)
+            except _UNAVAILABLE_ERRORS:
+                raise
             except Exception as e:
                 logging.error(f"Ошибка при поиске на Ozon: {e}")
                 return []
+        tiles = await self.flights.do(('ozon_tiles', normalize_query(query), count), scrape)
+        return [dict(t) for t in tiles]
+
+    def _cache_search_results(self, cache_key, products: list[dict]):
+        for product in products:
+            product_cache.put('ozon', product['article'], product, detailed=False)
+        logging.info(f"Успешно найдено {len(products)} товаров на Ozon.")
+        if products:
+            search_cache.set(cache_key, [dict(p) for p in products], SEARCH_CACHE_TTL['ozon'])
+
+    async def _search_products_uncached(self, query: str, count: int, cache_key) -> list[dict]:
+        tiles = await self._get_search_tiles(query, count)
+        incomplete = [i for i, p in enumerate(tiles) if not p['name'] or not p['price']]
+        if incomplete:
+            logging.info(f"Для {len(incomplete)} плиток Ozon не хватило данных, загружаем страницы товаров.")
+            details = await asyncio.gather(*(self.get_product_data(tiles[i]['article']) for i in incomplete),
+                                           return_exceptions=True)
+            for i, detail in zip(incomplete, details):
+                tiles[i] = detail if isinstance(detail, dict) else None
+        products = [p for p in tiles if p]
+        self._cache_search_results(cache_key, products)
+        return products
+
+    async def stream_search_products(self, query: str, count: int, worth_fetching=None):
+        """
+        Потоковый вариант search_products: асинхронный генератор, который сразу
+        отдаёт полные плитки со страницы поиска, а затем — товары, дозагруженные
+        со своих страниц, по мере готовности. worth_fetching(tile) -> bool
+        вызывается перед загрузкой каждой неполной плитки: False — плитка
+        пропускается (например, она заведомо не попадёт в топ). Может вернуть
+        awaitable — так решение принимает процесс бота, если парсер в воркере.
+        """
+        cache_key = ('ozon', normalize_query(query), count)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"Результаты Ozon по запросу '{query}' взяты из кэша.")
+            for product in cached:
+                yield dict(product)
+            return
+
+        tiles = await self._get_search_tiles(query, count)
+        products = [p for p in tiles if p['name'] and p['price']]
+        for product in products:
+            yield dict(product)
+
+        pending = [p for p in tiles if not p['name'] or not p['price']]
+        skipped = 0
+        running = set()
+        try:
+            while pending or running:
+                # Не больше задач, чем браузеров: остальные плитки ещё можно отсечь по мере роста топа
+                while pending and len(running) < OZON_DRIVERS_POOL_SIZE:
+                    tile = pending.pop(0)
+                    keep = True if worth_fetching is None else worth_fetching(tile)
+                    if inspect.isawaitable(keep):
+                        keep = await keep
+                    if not keep:
+                        skipped += 1
+                        continue
+                    running.add(asyncio.ensure_future(self.get_product_data(tile['article'])))
+                if not running:
+                    break
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = task.exception()
+                    if isinstance(error, _UNAVAILABLE_ERRORS):
+                        raise error
+                    detail = None if error else task.result()
+                    if detail:
+                        products.append(detail)
+                        yield dict(detail)
+        finally:
+            for task in running:
+                task.cancel()
+        if skipped:
+            logging.info(f"Ozon '{query}': пропущено {skipped} плиток, которые не могут попасть в топ.")
+        else:
+            # Полный результат годится и для обычного search_products
+            self._cache_search_results(cache_key, products)
 
-    def quit(self):
-        if self.driver:
-            self.driver.quit()
-            logging.info("Драйвер Ozon остановлен.")
\ No newline at end of file
+    async def quit(self):
+        await self.http.close()
+        await self.pool.quit()
+        logging.info("Драйверы Ozon остановлены.")
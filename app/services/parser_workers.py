@@ -0,0 +1,315 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import secrets
+import sys
+import zlib
+
+from app.config import (
+    PARSER_WORKER_HOST, PARSER_CALL_TIMEOUT, PARSER_CONNECT_TIMEOUT, PARSER_RESTART_DELAY,
+    PARSER_RESTART_MAX_DELAY, PARSER_STOP_TIMEOUT, PRODUCT_MAX_AGE,
+)
+from app.services.cache import normalize_query
+from app.services.fair_scheduler import ScrapersBusyError, current_user, current_class, INTERACTIVE
+from app.services.throttle import CircuitOpenError
+
+# Протокол: по JSON-объекту в строке через локальный TCP-сокет.
+# Первая строка клиента — {"token": ...}; дальше запросы и ответы связаны полем id.
+TOKEN_ENV = 'PARSER_WORKER_TOKEN'
+STREAM_LIMIT = 16 * 1024 * 1024  # максимальная длина строки (результаты поиска целиком)
+
+
+class ParserWorkerError(Exception):
+    """Воркер парсинга недоступен, не ответил вовремя или завершился с неожиданной ошибкой."""
+
+    @property
+    def user_message(self) -> str:
+        return "⚠️ Сервис поиска временно недоступен. Попробуйте через минуту."
+
+
+def encode(message: dict) -> bytes:
+    return json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+
+
+def encode_error(error: Exception) -> dict:
+    if isinstance(error, CircuitOpenError):
+        return {'type': 'CircuitOpenError', 'host': error.host, 'retry_in': error.retry_in}
+    if isinstance(error, ScrapersBusyError):
+        return {'type': 'ScrapersBusyError', 'job_class': error.job_class, 'waited': error.waited}
+    return {'type': type(error).__name__, 'message': str(error)}
+
+
+def decode_error(data: dict) -> Exception:
+    """Ошибки «магазин недоступен» восстанавливаются как есть, чтобы обработчики показали их пользователю."""
+    if data['type'] == 'CircuitOpenError':
+        return CircuitOpenError(data['host'], data['retry_in'])
+    if data['type'] == 'ScrapersBusyError':
+        return ScrapersBusyError(data['job_class'], data['waited'])
+    return ParserWorkerError(f"{data['type']}: {data.get('message', '')}")
+
+
+class _WorkerConnection:
+    """Соединение с одним воркером; одновременные вызовы различаются по id."""
+
+    def __init__(self, port: int, token: str):
+        self.port = port
+        self.token = token
+        self._writer: asyncio.StreamWriter | None = None
+        self._connect_lock = asyncio.Lock()
+        self._calls: dict[int, asyncio.Queue] = {}
+        self._ids = itertools.count(1)
+        self.in_flight = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def _ensure_connected(self):
+        async with self._connect_lock:
+            if self.connected:
+                return
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + PARSER_CONNECT_TIMEOUT
+            # Только что (пере)запущенный воркер может ещё не слушать порт
+            while True:
+                try:
+                    reader, writer = await asyncio.open_connection(PARSER_WORKER_HOST, self.port, limit=STREAM_LIMIT)
+                    break
+                except OSError as e:
+                    if loop.time() >= deadline:
+                        raise ParserWorkerError(f"Воркер парсинга на порту {self.port} недоступен: {e}") from None
+                    await asyncio.sleep(0.5)
+            writer.write(encode({'token': self.token}))
+            self._writer = writer
+            asyncio.create_task(self._read_loop(reader, writer))
+
+    async def _read_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                queue = self._calls.get(message.get('id'))
+                if queue is not None:
+                    queue.put_nowait(message)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ошибка чтения ответа воркера {self.port}: {e}")
+        finally:
+            writer.close()
+            if self._writer is writer:
+                self._writer = None
+            lost = {'error': {'type': 'ConnectionLost', 'message': f"соединение с воркером {self.port} потеряно"}}
+            for queue in self._calls.values():
+                queue.put_nowait(lost)
+
+    def _send(self, message: dict):
+        if not self.connected:
+            raise ParserWorkerError(f"Соединение с воркером {self.port} потеряно.")
+        self._writer.write(encode(message))
+
+    async def _start(self, store: str, method: str, args: list, kwargs: dict, ask: bool = False):
+        await self._ensure_connected()
+        call_id = next(self._ids)
+        # Пользователь и класс задания нужны справедливой очереди браузеров в воркере
+        self._send({'id': call_id, 'store': store, 'method': method, 'args': args, 'kwargs': kwargs,
+                    'user': current_user.get(), 'job_class': current_class.get(), 'ask': ask})
+        # Вызов регистрируется только после успешной отправки: иначе его некому было бы снять
+        self._calls[call_id] = asyncio.Queue()
+        self.in_flight += 1
+        return call_id
+
+    async def _receive(self, call_id: int, method: str) -> dict:
+        try:
+            message = await asyncio.wait_for(self._calls[call_id].get(), PARSER_CALL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise ParserWorkerError(f"Воркер {self.port} не ответил на {method} за {PARSER_CALL_TIMEOUT} с.") from None
+        if 'error' in message:
+            raise decode_error(message['error'])
+        return message
+
+    def _finish(self, call_id: int, done: bool):
+        self._calls.pop(call_id, None)
+        self.in_flight -= 1
+        # Вызывающий перестал ждать (тайм-аут, отмена) — воркеру незачем продолжать
+        if not done and self.connected:
+            self._send({'id': call_id, 'cancel': True})
+
+    async def call(self, store: str, method: str, args: list, kwargs: dict):
+        call_id = await self._start(store, method, args, kwargs)
+        done = False
+        try:
+            result = (await self._receive(call_id, method))['result']
+            done = True
+            return result
+        finally:
+            self._finish(call_id, done)
+
+    async def stream(self, store: str, method: str, args: list, kwargs: dict, worth_fetching=None):
+        call_id = await self._start(store, method, args, kwargs, ask=worth_fetching is not None)
+        done = False
+        try:
+            while True:
+                message = await self._receive(call_id, method)
+                if 'ask' in message:
+                    self._send({'id': call_id, 'answer': bool(worth_fetching(message['ask']))})
+                elif 'item' in message:
+                    yield message['item']
+                else:
+                    done = True
+                    return
+        finally:
+            self._finish(call_id, done)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class _Worker:
+    def __init__(self, port: int, token: str):
+        self.port = port
+        self.connection = _WorkerConnection(port, token)
+        self.process: asyncio.subprocess.Process | None = None
+        self.restarts = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+
+class ParserWorkerPool:
+    """
+    Процессы-воркеры с парсерами (python -m app.worker) и их супервизор.
+
+    Каждый воркер держит свой пул браузеров Ozon и HTTP-сессию WB, свои кэши
+    и справедливую очередь, и слушает свой порт на localhost. Поэтому вызов
+    направляется по устойчивому хэшу: интерактивный — по пользователю (лимит
+    браузеров на пользователя соблюдается в одном воркере), фоновый — по
+    магазину и запросу/артикулу (кэш и объединение одинаковых запросов
+    срабатывают в одном воркере). Если нужный воркер не запущен, вызов уходит
+    живому с наименьшим числом незавершённых вызовов. Упавший воркер (например, вместе с Chrome)
+    перезапускается с растущей паузой, а его вызовы завершаются
+    ParserWorkerError — процесс бота продолжает работать.
+    """
+
+    def __init__(self, count: int, base_port: int):
+        self._token = secrets.token_hex(16)
+        self._workers = [_Worker(base_port + i, self._token) for i in range(count)]
+        self._supervisors = []
+        self._closing = False
+
+    async def start(self):
+        for worker in self._workers:
+            self._supervisors.append(asyncio.create_task(self._supervise(worker)))
+
+    async def _supervise(self, worker: _Worker):
+        loop = asyncio.get_running_loop()
+        delay = PARSER_RESTART_DELAY
+        while not self._closing:
+            worker.process = await asyncio.create_subprocess_exec(
+                sys.executable, '-m', 'app.worker', str(worker.port), env={**os.environ, TOKEN_ENV: self._token}
+            )
+            started_at = loop.time()
+            logging.info(f"Воркер парсинга запущен: порт {worker.port}, pid {worker.process.pid}.")
+            code = await worker.process.wait()
+            if self._closing:
+                break
+            worker.restarts += 1
+            # Проработавший долго воркер упал случайно — перезапускаем без накопленной паузы
+            if loop.time() - started_at > PARSER_RESTART_MAX_DELAY:
+                delay = PARSER_RESTART_DELAY
+            logging.error(f"Воркер парсинга на порту {worker.port} завершился с кодом {code}, "
+                          f"перезапуск через {delay} с.")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, PARSER_RESTART_MAX_DELAY)
+
+    @staticmethod
+    def _route_key(store: str, method: str, args: tuple):
+        user = current_user.get()
+        if user is not None and current_class.get() == INTERACTIVE:
+            return 'user', user
+        if method in ('search_products', 'stream_search_products'):
+            return store, normalize_query(args[0])
+        return (store, str(args[0])) if args else None
+
+    def _pick(self, key=None) -> _WorkerConnection:
+        alive = [worker for worker in self._workers if worker.alive]
+        if not alive:
+            raise ParserWorkerError("Нет запущенных воркеров парсинга.")
+        if key is not None:
+            worker = self._workers[zlib.crc32(repr(key).encode()) % len(self._workers)]
+            if worker.alive:
+                return worker.connection
+        return min(alive, key=lambda worker: worker.connection.in_flight).connection
+
+    async def call(self, store: str, method: str, *args, **kwargs):
+        return await self._pick(self._route_key(store, method, args)).call(store, method, list(args), kwargs)
+
+    async def call_sharded(self, store: str, method: str, articles: list[str], **kwargs) -> list:
+        """Пакетный вызов: артикулы делятся между воркерами по тому же хэшу, что и одиночные вызовы."""
+        batches = {}
+        for article in articles:
+            batches.setdefault(self._pick((store, article)), []).append(article)
+        return await asyncio.gather(*(connection.call(store, method, [batch], kwargs)
+                                      for connection, batch in batches.items()))
+
+    def stream(self, store: str, method: str, *args, worth_fetching=None, **kwargs):
+        return self._pick(self._route_key(store, method, args)).stream(store, method, list(args), kwargs,
+                                                                        worth_fetching)
+
+    async def close(self):
+        """Просит воркеров завершиться (они закрывают браузеры) и ждёт их."""
+        self._closing = True
+        for worker in self._workers:
+            worker.connection.close()
+            if worker.alive:
+                worker.process.terminate()
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            try:
+                await asyncio.wait_for(worker.process.wait(), PARSER_STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                logging.warning(f"Воркер парсинга на порту {worker.port} не завершился вовремя, принудительная остановка.")
+                worker.process.kill()
+        for task in self._supervisors:
+            task.cancel()
+        logging.info("Воркеры парсинга остановлены.")
+
+    def stats(self) -> dict:
+        return {worker.port: {"alive": worker.alive, "in_flight": worker.connection.in_flight,
+                              "restarts": worker.restarts} for worker in self._workers}
+
+
+class RemoteParser:
+    """Парсер магазина, работающий в воркере; интерфейс как у OzonParser / WildberriesParser."""
+
+    def __init__(self, pool: ParserWorkerPool, store: str):
+        self.pool = pool
+        self.store = store
+
+    async def start(self):
+        pass
+
+    async def search_products(self, query: str, count: int = 20) -> list[dict]:
+        return await self.pool.call(self.store, 'search_products', query, count)
+
+    async def get_product_data(self, article: str, max_age: float = PRODUCT_MAX_AGE,
+                               allow_stale: bool = True, require_detail: bool = True) -> dict | None:
+        return await self.pool.call(self.store, 'get_product_data', str(article), max_age=max_age,
+                                    allow_stale=allow_stale, require_detail=require_detail)
+
+    async def get_products_data(self, articles: list[str], max_age: float = PRODUCT_MAX_AGE) -> dict[str, dict]:
+        products = {}
+        for batch in await self.pool.call_sharded(self.store, 'get_products_data', [str(a) for a in articles],
+                                                  max_age=max_age):
+            products.update(batch)
+        return products
+
+    async def stream_search_products(self, query: str, count: int, worth_fetching=None):
+        async for product in self.pool.stream(self.store, 'stream_search_products', query, count,
+                                              worth_fetching=worth_fetching):
+            yield product
+
+    async def quit(self):
+        """Воркеры останавливает ParserWorkerPool.close()."""
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import time
+
+from app import database as db
+from app.config import (
+    PRICE_HISTORY_FLUSH_INTERVAL, PRICE_HISTORY_RAW_DAYS, PRICE_HISTORY_RETENTION_DAYS,
+    PRODUCT_CACHE_MAX_ENTRIES, PRODUCT_CACHE_TTL,
+)
+from app.services.cache import TTLCache
+
+DOWNSAMPLE_INTERVAL = 24 * 3600
+
+
+class PriceHistoryRecorder:
+    """
+    Собирает наблюдения цен со всех загрузок товаров и пачкой пишет их в историю.
+    Повторы той же цены отсекаются ещё в памяти, остальное — в БД (run-length).
+    Раз в сутки старые точки сворачиваются в дневные min/max.
+    """
+
+    def __init__(self):
+        self._last = TTLCache(PRODUCT_CACHE_MAX_ENTRIES)  # (store, article) -> последняя записанная цена
+        self._pending = []
+        self._last_downsample = None
+        self.recorded = 0
+        self.skipped = 0
+
+    def record(self, store: str, article, product: dict):
+        price = product.get('price_with_card') or product.get('price')
+        if not price:
+            return
+        key = (store, str(article))
+        if self._last.get(key) == price:
+            self.skipped += 1
+            return
+        self._last.set(key, price, PRODUCT_CACHE_TTL)
+        self._pending.append((store, str(article), int(time.time()), price))
+        self.recorded += 1
+
+    async def flush(self):
+        points, self._pending = self._pending, []
+        try:
+            await db.add_price_points(points)
+        except Exception:
+            self._pending = points + self._pending
+            raise
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(PRICE_HISTORY_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+                if self._last_downsample is None or time.monotonic() - self._last_downsample >= DOWNSAMPLE_INTERVAL:
+                    await db.downsample_price_history(PRICE_HISTORY_RAW_DAYS, PRICE_HISTORY_RETENTION_DAYS)
+                    self._last_downsample = time.monotonic()
+            except Exception as e:
+                logging.error(f"Ошибка записи истории цен: {e}")
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "recorded": self.recorded, "skipped": self.skipped}
+
+
+price_history = PriceHistoryRecorder()
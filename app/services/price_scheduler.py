@@ -0,0 +1,193 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import defaultdict
+
+from app import database as db
+from app.config import (
+    PRICE_CHECK_INTERVAL, PRICE_SCHEDULER_TICK, PRICE_CHECK_CONCURRENCY, PRICE_CHECK_RATE, PRICE_CHECK_BURST,
+    PRICE_CHECK_JITTER, PRICE_CHECK_RETRY_DELAY, PRICE_NEAR_TARGET_RATIO, PRICE_NEAR_TARGET_FACTOR,
+    WB_DETAIL_BATCH_SIZE,
+)
+from app.services.rate_limit import TokenBucket
+from app.services.fair_scheduler import current_class, BACKGROUND
+
+
+class _CheckItem:
+    """Один товар к проверке со всеми его подписчиками."""
+
+    def __init__(self, store: str, product_id: str, rows: list):
+        self.store = store
+        self.product_id = product_id
+        self.rows = rows
+        # Товары, цена которых близка к цели хотя бы одного подписчика, проверяются первыми и чаще
+        self.near_target = any(
+            current and current <= desired * (1 + PRICE_NEAR_TARGET_RATIO)
+            for _, _, _, desired, current, _ in rows
+        )
+
+    @property
+    def key(self):
+        return self.store, self.product_id
+
+
+class PriceCheckScheduler:
+    """
+    Планировщик проверки цен. Раз в PRICE_SCHEDULER_TICK секунд забирает из БД
+    товары, у которых наступил next_check_at, и кладёт их в очередь с приоритетом.
+    Проверки идут параллельно (не больше PRICE_CHECK_CONCURRENCY) и ограничены
+    token bucket'ом для каждого магазина. Итоги пишутся в БД пачкой раз в тик.
+
+    notify(user_id, product_id, store, name, old_price, new_price, desired_price) -> bool
+    отправляет уведомление и возвращает True, если отслеживание можно удалить.
+    """
+
+    def __init__(self, ozon_parser, wb_parser, notify):
+        self.ozon_parser = ozon_parser
+        self.wb_parser = wb_parser
+        self.notify = notify
+        self.buckets = {store: TokenBucket(rate, PRICE_CHECK_BURST[store]) for store, rate in PRICE_CHECK_RATE.items()}
+        self._semaphore = asyncio.Semaphore(PRICE_CHECK_CONCURRENCY)
+        self._queue = []
+        self._seq = itertools.count()
+        self._has_items = asyncio.Event()
+        self._known = set()
+        self._finished = []
+        self._updates, self._removals, self._postponed = [], [], []
+        self.checked = 0
+        self.failed = 0
+
+    def _next_check_at(self, near_target: bool) -> int:
+        interval = PRICE_CHECK_INTERVAL * (PRICE_NEAR_TARGET_FACTOR if near_target else 1)
+        # Джиттер размазывает проверки по интервалу, чтобы они не шли пачками
+        return int(time.time() + interval * random.uniform(1 - PRICE_CHECK_JITTER, 1 + PRICE_CHECK_JITTER))
+
+    async def _refill_queue(self):
+        rows = await db.get_due_tracking_from_db()
+        grouped = defaultdict(list)
+        for row in rows:
+            _, product_id, _, _, _, store = row
+            if (store, product_id) not in self._known:
+                grouped[(store, product_id)].append(row)
+        for (store, product_id), item_rows in grouped.items():
+            item = _CheckItem(store, product_id, item_rows)
+            self._known.add(item.key)
+            heapq.heappush(self._queue, (0 if item.near_target else 1, next(self._seq), item))
+        if grouped:
+            logging.info(f"В очередь проверки цен добавлено товаров: {len(grouped)} (в очереди: {len(self._queue)}).")
+            self._has_items.set()
+
+    def _pop_job(self) -> list[_CheckItem]:
+        _, _, first = heapq.heappop(self._queue)
+        if first.store != 'wb':
+            return [first]
+        # Товары WB проверяются пакетом через один запрос к API
+        batch, rest = [first], []
+        while self._queue and len(batch) < WB_DETAIL_BATCH_SIZE:
+            entry = heapq.heappop(self._queue)
+            if entry[2].store == 'wb':
+                batch.append(entry[2])
+            else:
+                rest.append(entry)
+        for entry in rest:
+            heapq.heappush(self._queue, entry)
+        return batch
+
+    async def _fetch(self, job: list[_CheckItem]) -> dict:
+        store = job[0].store
+        await self.buckets[store].acquire()
+        # Плановой проверке нужны свежие данные, но результат недавнего поиска тоже подойдёт
+        max_age = PRICE_CHECK_INTERVAL / 2
+        if store == 'wb':
+            return await self.wb_parser.get_products_data([item.product_id for item in job], max_age=max_age)
+        product = await self.ozon_parser.get_product_data(job[0].product_id, max_age=max_age, allow_stale=False)
+        return {job[0].product_id: product} if product else {}
+
+    async def _evaluate(self, item: _CheckItem, product_data: dict | None):
+        if not product_data or not product_data.get('price'):
+            logging.warning(f"Не удалось получить данные для товара {item.product_id} при плановой проверке.")
+            self.failed += 1
+            self._postponed.append((item.store, item.product_id, time.time() + PRICE_CHECK_RETRY_DELAY))
+            return
+
+        self.checked += 1
+        # Используем цену с картой, если она выгоднее
+        new_price = product_data.get('price_with_card') or product_data.get('price')
+        near_target = False
+        remaining = []
+        for user_id, product_id, name, desired_price, old_price, store in item.rows:
+            if new_price <= desired_price:
+                logging.info(f"ЦЕНА СНИЖЕНА! Товар {product_id}, новая цена {new_price} <= желаемой {desired_price}.")
+                if await self.notify(user_id, product_id, store, name, old_price, new_price, desired_price):
+                    self._removals.append((user_id, product_id))
+                    continue
+            near_target = near_target or new_price <= desired_price * (1 + PRICE_NEAR_TARGET_RATIO)
+            remaining.append((user_id, product_id))
+        # next_check_at общий для всех подписчиков товара — тогда их снова проверят одним запросом
+        next_check_at = self._next_check_at(near_target)
+        self._updates.extend((user_id, product_id, int(new_price), next_check_at) for user_id, product_id in remaining)
+
+    async def _run_job(self, job: list[_CheckItem]):
+        pending = list(job)
+        try:
+            products = await self._fetch(job)
+            while pending:
+                await self._evaluate(pending[0], products.get(pending[0].product_id))
+                pending.pop(0)
+        except Exception as e:
+            logging.error(f"Ошибка при проверке цен ({job[0].store}, {len(job)} шт.): {e}")
+            for item in pending:
+                self._postponed.append((item.store, item.product_id, time.time() + PRICE_CHECK_RETRY_DELAY))
+        finally:
+            self._finished.extend(item.key for item in job)
+            self._semaphore.release()
+
+    async def _dispatch_loop(self):
+        while True:
+            await self._semaphore.acquire()
+            while not self._queue:
+                self._has_items.clear()
+                await self._has_items.wait()
+            asyncio.create_task(self._run_job(self._pop_job()))
+
+    async def _flush(self):
+        updates, removals, postponed = self._updates, self._removals, self._postponed
+        finished, self._finished = self._finished, []
+        self._updates, self._removals, self._postponed = [], [], []
+        try:
+            await db.apply_price_check_results(updates, removals, postponed)
+        except Exception:
+            # Вернём итоги в буфер, чтобы записать их на следующем тике
+            self._updates = updates + self._updates
+            self._removals = removals + self._removals
+            self._postponed = postponed + self._postponed
+            self._finished.extend(finished)
+            raise
+        # Товар можно снова ставить в очередь только после записи его next_check_at
+        self._known.difference_update(finished)
+        if updates or removals or postponed:
+            logging.info(f"Проверка цен: обновлено {len(updates)}, удалено {len(removals)}, "
+                         f"отложено {len(postponed)}; в очереди {len(self._queue)}.")
+
+    async def run(self):
+        logging.info("Планировщик проверки цен запущен.")
+        # Все проверки (задачи наследуют контекст) идут в очередь браузеров фоновым классом
+        current_class.set(BACKGROUND)
+        dispatcher = asyncio.create_task(self._dispatch_loop())
+        try:
+            while True:
+                try:
+                    await self._flush()
+                    await self._refill_queue()
+                except Exception as e:
+                    logging.error(f"Критическая ошибка в планировщике проверки цен: {e}")
+                await asyncio.sleep(PRICE_SCHEDULER_TICK)
+        finally:
+            dispatcher.cancel()
+
+    def stats(self) -> dict:
+        return {"queued": len(self._queue), "in_progress": len(self._known) - len(self._queue),
+                "checked": self.checked, "failed": self.failed}
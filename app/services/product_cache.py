@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+
+from app.config import PRODUCT_CACHE_MAX_ENTRIES, PRODUCT_CACHE_TTL
+from app.services.cache import TTLCache
+from app.services.price_history import price_history
+
+
+class ProductCache:
+    """
+    Общий кэш данных о товарах по ключу (магазин, артикул).
+    Каждый вызывающий сам указывает допустимый возраст данных (max_age).
+    Устаревшая запись при allow_stale=True отдаётся сразу, а обновление
+    запускается в фоне. Цены со страницы товара попадают в историю цен;
+    плитки поиска Ozon — нет: у них часто нет цены по карте, и чередование
+    двух цен одного товара раздувало бы историю и сбивало минимум за период.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.ttl = ttl
+        self._entries = TTLCache(max_entries)  # key -> (fetched_at, detailed, product)
+        self._refreshing = {}
+        self.fresh_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def put(self, store: str, article, product: dict, detailed: bool = True):
+        if detailed:
+            price_history.record(store, article, product)
+        key = (store, str(article))
+        current = self._entries.get(key)
+        # Данные с плитки поиска не должны затирать более полные данные со страницы товара
+        if not detailed and current and current[1] and time.monotonic() - current[0] < self.ttl:
+            return
+        self._entries.set(key, (time.monotonic(), detailed, dict(product)), self.ttl)
+
+    def peek(self, store: str, article, max_age: float, require_detail: bool = False) -> dict | None:
+        entry = self._entries.get((store, str(article)))
+        if entry is None:
+            return None
+        fetched_at, detailed, product = entry
+        if time.monotonic() - fetched_at > max_age or (require_detail and not detailed):
+            return None
+        return dict(product)
+
+    def _refresh_in_background(self, key, fetch):
+        if key in self._refreshing:
+            return
+
+        async def refresh():
+            try:
+                product = await fetch(key[1])
+                if product:
+                    self.put(key[0], key[1], product)
+            except Exception as e:
+                logging.warning(f"Фоновое обновление товара {key} не удалось: {e}")
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.create_task(refresh())
+
+    async def get(self, store: str, article, fetch, max_age: float,
+                  allow_stale: bool = True, require_detail: bool = True) -> dict | None:
+        """
+        Возвращает данные о товаре из кэша или через fetch(article).
+        fetch — корутина загрузки без кэша.
+        """
+        key = (store, str(article))
+        entry = self._entries.get(key)
+        if entry is not None and (entry[1] or not require_detail):
+            fetched_at, _, product = entry
+            if time.monotonic() - fetched_at <= max_age:
+                self.fresh_hits += 1
+                return dict(product)
+            if allow_stale:
+                self.stale_hits += 1
+                self._refresh_in_background(key, fetch)
+                return dict(product)
+
+        self.misses += 1
+        product = await fetch(key[1])
+        if product:
+            self.put(store, key[1], product)
+        return product
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries), "fresh_hits": self.fresh_hits,
+            "stale_hits": self.stale_hits, "misses": self.misses,
+            "refreshing": len(self._refreshing),
+        }
+
+
+product_cache = ProductCache(PRODUCT_CACHE_MAX_ENTRIES, PRODUCT_CACHE_TTL)
@@ -0,0 +1,100 @@
+import json
+import math
+import secrets
+import time
+
+from app import database as db
+from app.config import (
+    PRODUCT_URL_TEMPLATES, SEARCH_SESSION_MAX_ENTRIES, SEARCH_SESSION_MAX_BYTES, SEARCH_SESSION_TTL, WEBHOOK_WORKERS,
+)
+from app.services.cache import TTLCache
+
+# Товар хранится кортежем в этом порядке: без ключей словаря, отображаемого
+# названия магазина и ссылки (она восстанавливается по артикулу).
+_FIELDS = ('name', 'price', 'price_with_card', 'rating', 'reviews_count', 'purchases_count', 'article', 'image_url')
+_STORE_CODES = {"🔵 Ozon": 'ozon', "🍓 Wildberries": 'wb'}
+_STORE_TITLES = {code: title for title, code in _STORE_CODES.items()}
+
+
+def _pack(product: dict) -> tuple:
+    return (_STORE_CODES.get(product['store'], 'ozon'), *(product.get(field) for field in _FIELDS))
+
+
+def _unpack(packed: tuple) -> dict:
+    store, *values = packed
+    product = dict(zip(_FIELDS, values))
+    product['store'] = _STORE_TITLES[store]
+    product['url'] = PRODUCT_URL_TEMPLATES[store].format(product['article'])
+    return product
+
+
+class SearchSession:
+    def __init__(self, user_id, query: str, products: list, page_size: int, ranked: bool):
+        self.user_id = user_id
+        self.query = query
+        self.page_size = page_size
+        self.ranked = ranked
+        self.items = tuple(_pack(p) for p in products)
+
+    @classmethod
+    def from_row(cls, row) -> 'SearchSession':
+        user_id, query, page_size, ranked, items, _ = row
+        session = cls(user_id, query, [], page_size, bool(ranked))
+        session.items = tuple(tuple(item) for item in json.loads(items))
+        return session
+
+    @property
+    def pages(self) -> int:
+        return max(1, math.ceil(len(self.items) / self.page_size))
+
+    def page(self, number: int) -> list[dict]:
+        """Товары страницы number (с 1) в исходном порядке выдачи."""
+        start = (number - 1) * self.page_size
+        return [_unpack(item) for item in self.items[start:start + self.page_size]]
+
+
+class SearchSessionStore:
+    """
+    Полные результаты поиска для постраничного просмотра без повторного парсинга.
+    Сессия живёт SEARCH_SESSION_TTL и вытесняется по LRU, память ограничена по
+    числу сессий и байтам. Ключ — короткий id, который передаётся в callback_data.
+
+    shared=True — для нескольких процессов-воркеров вебхука: нажатие «дальше»
+    может прийти не в тот процесс, где шёл поиск, поэтому сессия сразу
+    записывается в БД, а при промахе памяти читается оттуда. Сессия после
+    создания не меняется, так что копия в памяти любого процесса всегда верна.
+    """
+
+    def __init__(self, shared: bool = False):
+        self.shared = shared
+        self._sessions = TTLCache(SEARCH_SESSION_MAX_ENTRIES, SEARCH_SESSION_MAX_BYTES)
+        self.db_reads = 0
+
+    async def create(self, user_id, query: str, products: list, page_size: int,
+                     ranked: bool = False) -> tuple[str, SearchSession]:
+        session_id = secrets.token_hex(4)
+        session = SearchSession(user_id, query, products, page_size, ranked)
+        if self.shared:
+            await db.save_search_session(session_id, user_id, query, page_size, ranked,
+                                         json.dumps(session.items, ensure_ascii=False, separators=(',', ':')),
+                                         SEARCH_SESSION_TTL)
+        self._sessions.set(session_id, session, SEARCH_SESSION_TTL)
+        return session_id, session
+
+    async def get(self, session_id: str) -> SearchSession | None:
+        session = self._sessions.get(session_id)
+        if session is not None or not self.shared:
+            return session
+        self.db_reads += 1
+        row = await db.get_search_session(session_id)
+        if row is None:
+            return None
+        session = SearchSession.from_row(row)
+        self._sessions.set(session_id, session, row[-1] - time.time())
+        return session
+
+    def stats(self) -> dict:
+        return {"sessions": len(self._sessions), "bytes": self._sessions.total_bytes, "db_reads": self.db_reads}
+
+
+search_sessions = SearchSessionStore(shared=WEBHOOK_WORKERS > 1)
@@ -0,0 +1,191 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+from aiogram.utils.exceptions import RetryAfter, NetworkError, RestartingTelegram
+
+from app.config import (
+    SEND_GLOBAL_RATE, SEND_GLOBAL_BURST, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_CONCURRENCY,
+    SEND_RETRIES, SEND_RETRY_BASE_DELAY,
+)
+from app.services.cache import TTLCache
+from app.services.rate_limit import TokenBucket
+
+PRIORITY_ALERT = 0  # уведомления о снижении цены
+PRIORITY_BULK = 1  # карточки товаров, списки избранного и отслеживаний
+
+_TRANSIENT_ERRORS = (NetworkError, RestartingTelegram, asyncio.TimeoutError)
+_CHAT_BUCKET_TTL = 10 * 60
+
+
+class _SendJob:
+    def __init__(self, chat_id, method, args, kwargs):
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.attempt = 0
+
+
+class SendQueue:
+    """
+    Общая очередь исходящих сообщений Telegram.
+
+    Отправки ограничены общим token bucket'ом и bucket'ом для каждого чата.
+    Уведомления обгоняют массовые списки, а сообщения одного чата уходят
+    строго по очереди. RetryAfter откладывает только свой чат на указанное
+    Telegram время, сетевые ошибки повторяются с экспоненциальной паузой.
+    Остальные ошибки (BotBlocked, BadRequest...) возвращаются вызывающему.
+    """
+
+    def __init__(self):
+        self._global = TokenBucket(SEND_GLOBAL_RATE, SEND_GLOBAL_BURST)
+        self._chat_buckets = TTLCache(100_000)
+        self._heap = []
+        self._seq = itertools.count()
+        self._busy_chats = set()
+        self._paused_until = {}  # chat_id -> monotonic-время, раньше которого чату слать нельзя
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+        self._dispatcher = None
+        self._latencies = deque(maxlen=1000)
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.retry_after = 0
+
+    def start(self):
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for _, _, job in self._heap:
+            if not job.future.done():
+                job.future.cancel()
+        self._heap.clear()
+
+    async def send(self, chat_id, method, *args, priority: int = PRIORITY_BULK, **kwargs):
+        """
+        Ставит вызов method(*args, **kwargs) — например, bot.send_message или
+        message.answer_photo — в очередь и возвращает его результат.
+        """
+        job = _SendJob(chat_id, method, args, kwargs)
+        self._push(priority, job)
+        return await job.future
+
+    def _push(self, priority, job, seq=None):
+        heapq.heappush(self._heap, (priority, next(self._seq) if seq is None else seq, job))
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(SEND_CHAT_RATE, SEND_CHAT_BURST)
+        # Продлеваем срок при каждом обращении: простаивающий bucket всё равно был бы полон
+        self._chat_buckets.set(chat_id, bucket, _CHAT_BUCKET_TTL)
+        return bucket
+
+    def _take_ready(self):
+        """
+        Забирает из кучи первую задачу, чей чат свободен и не исчерпал лимит.
+        Возвращает (запись или None, сколько ждать до ближайшей готовой).
+        """
+        now = time.monotonic()
+        skipped, seen, wait, found = [], set(), None, None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            job = entry[2]
+            if job.future.done():  # вызывающий перестал ждать
+                continue
+            # Более позднее сообщение чата не обгоняет уже пропущенное раннее
+            if job.chat_id in self._busy_chats or job.chat_id in seen:
+                skipped.append(entry)
+                continue
+            seen.add(job.chat_id)
+            delay = max(self._paused_until.get(job.chat_id, 0) - now, 0)
+            if not delay:
+                self._paused_until.pop(job.chat_id, None)
+                delay = self._chat_bucket(job.chat_id).delay_until_available()
+            if delay:
+                wait = delay if wait is None else min(wait, delay)
+                skipped.append(entry)
+                continue
+            self._chat_bucket(job.chat_id).try_acquire()
+            found = entry
+            break
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return found, wait
+
+    async def _dispatch_loop(self):
+        while True:
+            await self._semaphore.acquire()
+            while True:
+                self._wakeup.clear()
+                entry, wait = self._take_ready()
+                if entry is not None:
+                    break
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+            self._busy_chats.add(entry[2].chat_id)
+            await self._global.acquire()
+            asyncio.create_task(self._deliver(*entry))
+
+    async def _deliver(self, priority, seq, job: _SendJob):
+        try:
+            result = await job.method(*job.args, **job.kwargs)
+        except RetryAfter as e:
+            self.retry_after += 1
+            logging.warning(f"Telegram просит подождать {e.timeout} с перед отправкой в чат {job.chat_id}.")
+            self._paused_until[job.chat_id] = time.monotonic() + e.timeout
+            self._push(priority, job, seq)
+        except _TRANSIENT_ERRORS as e:
+            job.attempt += 1
+            if job.attempt > SEND_RETRIES:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                self.retried += 1
+                delay = SEND_RETRY_BASE_DELAY * 2 ** (job.attempt - 1)
+                logging.warning(f"Сбой отправки в чат {job.chat_id}: {e!r}, повтор через {delay:.0f} с.")
+                self._paused_until[job.chat_id] = time.monotonic() + delay
+                self._push(priority, job, seq)
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.sent += 1
+            self._latencies.append(time.monotonic() - job.enqueued_at)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._busy_chats.discard(job.chat_id)
+            self._semaphore.release()
+            self._wakeup.set()
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        by_priority = {}
+        for priority, _, _ in self._heap:
+            by_priority[priority] = by_priority.get(priority, 0) + 1
+        return {
+            "depth": len(self._heap), "depth_by_priority": by_priority, "in_flight": len(self._busy_chats),
+            "sent": self.sent, "failed": self.failed, "retried": self.retried, "retry_after": self.retry_after,
+            "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+        }
+
+
+send_queue = SendQueue()
@@ -0,0 +1,31 @@
+import asyncio
+import logging
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые запросы: пока задача с ключом key
+    выполняется, остальные вызывающие ждут её результата вместо повторного парсинга.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: dict = {}
+        self.executed = 0
+        self.saved = 0
+
+    async def do(self, key, factory):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.saved += 1
+            logging.info(f"[{self.name}] Запрос {key} присоединён к уже выполняющемуся (сэкономлено: {self.saved}).")
+        else:
+            self.executed += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: отмена одного ожидающего не должна прерывать общий парсинг
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"executed": self.executed, "saved": self.saved, "in_flight": len(self._inflight)}
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+
+from app.config import (
+    THROTTLE_BASE_DELAY, THROTTLE_MAX_DELAY, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_OPEN_SECONDS, CIRCUIT_MAX_OPEN_SECONDS,
+)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class ChallengePageError(Exception):
+    """Сайт отдал страницу антибота/капчи вместо контента."""
+
+
+class CircuitOpenError(Exception):
+    """Запросы к хосту временно не выполняются: сработал предохранитель."""
+
+    def __init__(self, host: str, retry_in: float):
+        self.host = host
+        self.retry_in = retry_in
+        super().__init__(f"Хост {host} временно недоступен, повтор через {retry_in:.0f} с.")
+
+    @property
+    def user_message(self) -> str:
+        minutes = max(1, round(self.retry_in / 60))
+        return f"⏳ Магазин временно ограничил доступ. Попробуйте через {minutes} мин."
+
+
+class _HostState:
+    def __init__(self):
+        self.state = CLOSED
+        self.delay = 0.0
+        self.next_allowed_at = 0.0
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.probe_in_flight = False
+        self.probe_started_at = 0.0
+        self.failures = Counter()
+        self.successes = 0
+        self.rejected = 0
+
+
+class HostThrottle:
+    """
+    Адаптивный троттлинг и предохранитель (circuit breaker) для каждого хоста.
+
+    После каждой ошибки (капча, не-200, тайм-аут) пауза между запросами к хосту
+    удваивается, после успеха — уменьшается вдвое. Если ошибок подряд набралось
+    CIRCUIT_FAILURE_THRESHOLD, предохранитель размыкается: запросы сразу
+    получают CircuitOpenError. По истечении паузы пропускается один пробный
+    запрос (half-open): успех замыкает цепь, ошибка размыкает её на вдвое больший срок.
+    """
+
+    def __init__(self):
+        self._hosts: dict[str, _HostState] = {}
+
+    def _get(self, host: str) -> _HostState:
+        return self._hosts.setdefault(host, _HostState())
+
+    def check(self, host: str):
+        """Бросает CircuitOpenError, если к хосту сейчас нельзя обращаться."""
+        state = self._get(host)
+        now = time.monotonic()
+        if state.state == OPEN:
+            if now < state.open_until:
+                state.rejected += 1
+                raise CircuitOpenError(host, state.open_until - now)
+            state.state = HALF_OPEN
+            state.probe_in_flight = False
+            logging.info(f"Предохранитель {host}: пробный запрос (half-open).")
+        if state.state == HALF_OPEN:
+            # Пробный запрос мог потеряться (например, его отменили) — не ждём его вечно
+            if state.probe_in_flight and now - state.probe_started_at < THROTTLE_MAX_DELAY:
+                state.rejected += 1
+                raise CircuitOpenError(host, THROTTLE_BASE_DELAY)
+            state.probe_in_flight = True
+            state.probe_started_at = now
+
+    async def before_request(self, host: str):
+        self.check(host)
+        state = self._get(host)
+        now = time.monotonic()
+        wait = state.next_allowed_at - now
+        state.next_allowed_at = max(now, state.next_allowed_at) + state.delay
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record_success(self, host: str):
+        state = self._get(host)
+        state.successes += 1
+        state.consecutive_failures = 0
+        state.delay = state.delay / 2 if state.delay / 2 >= THROTTLE_BASE_DELAY else 0.0
+        if state.state != CLOSED:
+            logging.info(f"Предохранитель {host}: хост снова доступен.")
+        state.state = CLOSED
+        state.trips = 0
+        state.probe_in_flight = False
+
+    def record_failure(self, host: str, reason: str):
+        """reason: 'challenge', 'status', 'timeout' или 'error'."""
+        state = self._get(host)
+        state.failures[reason] += 1
+        state.consecutive_failures += 1
+        state.delay = min(THROTTLE_MAX_DELAY, max(THROTTLE_BASE_DELAY, state.delay * 2))
+        if state.state == HALF_OPEN or state.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+            state.trips += 1
+            open_for = min(CIRCUIT_MAX_OPEN_SECONDS, CIRCUIT_OPEN_SECONDS * 2 ** (state.trips - 1))
+            state.state = OPEN
+            state.open_until = time.monotonic() + open_for
+            state.probe_in_flight = False
+            logging.warning(f"Предохранитель {host} разомкнут на {open_for:.0f} с (причина: {reason}, "
+                            f"ошибок подряд: {state.consecutive_failures}).")
+        else:
+            logging.info(f"{host}: ошибка '{reason}', пауза между запросами {state.delay:.1f} с.")
+
+    def stats(self) -> dict:
+        return {
+            host: {
+                "state": state.state, "delay": state.delay, "successes": state.successes,
+                "failures": dict(state.failures), "rejected": state.rejected,
+            }
+            for host, state in self._hosts.items()
+        }
+
+
+throttle = HostThrottle()
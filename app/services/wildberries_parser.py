@@ -1,8 +1,30 @@
 import logging
-import aiohttp
+
+from app.config import WB_DETAIL_BATCH_SIZE, SEARCH_CACHE_TTL, PRODUCT_MAX_AGE
+from app.services.cache import search_cache, normalize_query
+from app.services.product_cache import product_cache
+from app.services.throttle import CircuitOpenError
+from app.services.http_session import create_session, get_json
+
+_HEADERS = {
+    'Accept': '*/*',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+}
 
 class WildberriesParser:
-    
+    def __init__(self):
+        self.session = None
+
+    async def start(self):
+        if self.session is None or self.session.closed:
+            self.session = create_session(_HEADERS)
+            logging.info("HTTP-сессия Wildberries открыта.")
+
+    async def _get_session(self):
+        if self.session is None or self.session.closed:
+            await self.start()
+        return self.session
+
     def _get_image_url(self, article: int, order: int = 1) -> str:
        
         article_int = int(article)
@@ -19,55 +41,122 @@ class WildberriesParser:
         
         return f"{host}/vol{vol}/part{part}/{article_int}/images/big/{order}.jpg"
 
+    def _get_price(self, item: dict) -> float:
+        if item.get('salePriceU'):
+            return item['salePriceU'] / 100
+        # В API card.wb.ru v2 цена лежит в размерах товара
+        for size in item.get('sizes') or []:
+            price = (size.get('price') or {}).get('product')
+            if price:
+                return price / 100
+        return 0
+
+    def _product_from_item(self, item: dict) -> dict:
+        return {
+            "store": "🍓 Wildberries",
+            "name": item.get('name', 'Без названия'),
+            "price": self._get_price(item),
+            "price_with_card": None, 
+            "reviews_count": item.get('feedbacks', 0),
+            "rating": item.get('rating', 0),
+            "purchases_count": item.get('ordersCount', 0),
+            "article": item.get('id'),
+            "url": f"https://www.wildberries.ru/catalog/{item.get('id')}/detail.aspx",
+            "image_url": self._get_image_url(item.get('id'), order=1),
+        }
+
     async def search_products(self, query: str, count: int = 20) -> list[dict]:
         """
         Ищет товары по запросу через API и сразу возвращает список с полными данными.
         """
+        cache_key = ('wb', normalize_query(query), count)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"Результаты Wildberries по запросу '{query}' взяты из кэша.")
+            return [dict(p) for p in cached]
+
         search_url = f"https://search.wb.ru/exactmatch/ru/common/v4/search?appType=1&curr=rub&dest=-1257786&query={query}&resultset=catalog&sort=popular&spp=30&suppressSpellcheck=false&limit={count}"
         
         products = []
         try:
-            headers = {
-                'Accept': '*/*',
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            }
-            async with aiohttp.ClientSession(headers=headers) as session:
-                async with session.get(search_url) as response:
-                    if response.status != 200:
-                        logging.error(f"Ошибка запроса к WB API: статус {response.status}")
-                        return []
-                    data = await response.json(content_type=None)
+            data = await get_json(await self._get_session(), search_url)
+            if data is None:
+                return []
 
             if not data.get('data', {}).get('products'):
                 logging.warning("WB API вернул успешный ответ, но без товаров.")
                 return []
 
             for item in data['data']['products']:
-                price = item.get('salePriceU', 0) / 100
-                
-                products.append({
-                    "store": "🍓 Wildberries",
-                    "name": item.get('name', 'Без названия'),
-                    "price": price,
-                    "price_with_card": None, 
-                    "reviews_count": item.get('feedbacks', 0),
-                    "rating": item.get('rating', 0),
-                    "purchases_count": item.get('ordersCount', 0),
-                    "article": item.get('id'),
-                    "url": f"https://www.wildberries.ru/catalog/{item.get('id')}/detail.aspx",
-                    "image_url": self._get_image_url(item.get('id'), order=1),
-                })
+                product = self._product_from_item(item)
+                product_cache.put('wb', product['article'], product)
+                products.append(product)
             
             logging.info(f"Успешно найдено {len(products)} товаров на Wildberries.")
+            search_cache.set(cache_key, [dict(p) for p in products], SEARCH_CACHE_TTL['wb'])
             return products
 
+        except CircuitOpenError:
+            raise
         except Exception as e:
             logging.error(f"Критическая ошибка при парсинге Wildberries: {e}")
             return []
 
-    async def get_product_data(self, article: str) -> dict | None:
-        logging.warning("Метод get_product_data для WB API не используется. Используйте search_products.")
-        return None
+    async def _fetch_details_batch(self, articles: list[str]) -> dict[str, dict]:
+        detail_url = f"https://card.wb.ru/cards/v2/detail?appType=1&curr=rub&dest=-1257786&spp=30&nm={';'.join(articles)}"
+        data = await get_json(await self._get_session(), detail_url)
+        if data is None:
+            return {}
+        return {str(item.get('id')): self._product_from_item(item) for item in data.get('data', {}).get('products', [])}
+
+    async def get_products_data(self, articles: list[str], max_age: float = PRODUCT_MAX_AGE) -> dict[str, dict]:
+        """
+        Загружает карточки сразу для многих артикулов (до WB_DETAIL_BATCH_SIZE за запрос).
+        Артикулы, данные по которым в кэше не старше max_age, не запрашиваются.
+        Возвращает словарь {артикул: данные товара}; отсутствующие артикулы пропускаются.
+        """
+        unique_articles = list(dict.fromkeys(str(a) for a in articles))
+        products = {}
+        missing = []
+        for article in unique_articles:
+            cached = product_cache.peek('wb', article, max_age)
+            if cached:
+                products[article] = cached
+            else:
+                missing.append(article)
+
+        for i in range(0, len(missing), WB_DETAIL_BATCH_SIZE):
+            batch = missing[i:i + WB_DETAIL_BATCH_SIZE]
+            try:
+                fetched = await self._fetch_details_batch(batch)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                logging.error(f"Ошибка при загрузке карточек WB ({len(batch)} шт.): {e}")
+                continue
+            for article, product in fetched.items():
+                product_cache.put('wb', article, product)
+            products.update(fetched)
+        logging.info(f"Загружено {len(products)} из {len(unique_articles)} карточек Wildberries "
+                     f"({len(unique_articles) - len(missing)} из кэша).")
+        return products
+
+    async def _fetch_product_data(self, article: str) -> dict | None:
+        try:
+            products = await self._fetch_details_batch([str(article)])
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logging.error(f"Ошибка при загрузке карточки WB {article}: {e}")
+            return None
+        return products.get(str(article))
+
+    async def get_product_data(self, article: str, max_age: float = PRODUCT_MAX_AGE,
+                               allow_stale: bool = True, require_detail: bool = True) -> dict | None:
+        return await product_cache.get('wb', article, self._fetch_product_data, max_age,
+                                       allow_stale=allow_stale, require_detail=require_detail)
 
-    def quit(self):
-        logging.info("Парсер WB (API) не требует закрытия драйвера.")
\ No newline at end of file
+    async def quit(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+            logging.info("HTTP-сессия Wildberries закрыта.")
\ No newline at end of file
@@ -0,0 +1,70 @@
+import asyncio
+import hmac
+import json
+import logging
+
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiohttp import web
+
+from app.config import WEBHOOK_SECRET, WEBHOOK_DRAIN_TIMEOUT
+from app.services.metrics import metrics
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# Ссылки на обновления в обработке, чтобы задачи не собрал сборщик мусора
+_processing: set[asyncio.Task] = set()
+
+
+async def drain_updates():
+    """
+    Перед остановкой ждёт обновления, принятые в обработку, не дольше
+    WEBHOOK_DRAIN_TIMEOUT, остальные отменяет: иначе они работали бы
+    с уже закрытыми парсерами и БД.
+    """
+    if not _processing:
+        return
+    logging.info(f"Дожидаюсь обработки {len(_processing)} обновлений...")
+    _, pending = await asyncio.wait(set(_processing), timeout=WEBHOOK_DRAIN_TIMEOUT)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logging.warning(f"Отменено необработанных обновлений: {len(pending)}.")
+        await asyncio.wait(pending)
+
+
+def _authorized(request: web.Request) -> bool:
+    secret = request.headers.get(SECRET_HEADER, '')
+    return hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode())
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """Снимок статистики процесса-воркера в JSON."""
+    if not _authorized(request):
+        raise web.HTTPUnauthorized()
+    return web.json_response(metrics.snapshot(), dumps=lambda data: json.dumps(data, ensure_ascii=False, default=str))
+
+
+class TelegramWebhookHandler(WebhookRequestHandler):
+    """
+    Приём обновлений от Telegram (или локального прокси).
+
+    Запрос без верного секретного заголовка отклоняется. Обновление
+    обрабатывается в фоне, а Telegram сразу получает 200: поиск может идти
+    десятки секунд, и ждать его на открытом соединении незачем — к тому же
+    aiohttp отменил бы обработку, если бы клиент закрыл соединение.
+    """
+
+    async def post(self):
+        self.validate_ip()
+        if not _authorized(self.request):
+            logging.warning(f"Вебхук: запрос с {self.request.remote} без верного секретного токена отклонён.")
+            raise web.HTTPUnauthorized()
+        dispatcher = self.get_dispatcher()
+        try:
+            update = await self.parse_update(dispatcher.bot)
+        except (ValueError, TypeError) as e:
+            raise web.HTTPBadRequest(text=f"Некорректное обновление: {e}")
+        task = asyncio.create_task(dispatcher.updates_handler.notify(update))
+        _processing.add(task)
+        task.add_done_callback(_processing.discard)
+        return web.Response(text='ok')
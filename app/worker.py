@@ -0,0 +1,148 @@
+"""
+Процесс-воркер парсинга: python -m app.worker <порт>.
+
+Запускается и перезапускается ботом при PARSER_WORKERS > 0. Держит свои
+OzonParser и WildberriesParser и выполняет их вызовы, присланные JSON-строками
+через локальный TCP-сокет (протокол — в app/services/parser_workers.py).
+"""
+import asyncio
+import hmac
+import json
+import logging
+import os
+import signal
+import sys
+
+from app import database as db
+from app.config import PARSER_WORKER_HOST
+from app.services.fair_scheduler import current_user, current_class, INTERACTIVE
+from app.services.metrics import metrics, register_parser_metrics
+from app.services.ozon_parser import OzonParser
+from app.services.parser_workers import TOKEN_ENV, STREAM_LIMIT, encode, encode_error
+from app.services.price_history import price_history
+from app.services.wildberries_parser import WildberriesParser
+
+_METHODS = {'search_products', 'get_product_data', 'get_products_data', 'stream_search_products'}
+_AUTH_TIMEOUT = 5  # секунд на первую строку с токеном
+
+
+class WorkerServer:
+    def __init__(self, parsers: dict, token: str):
+        self.parsers = parsers
+        self.token = token
+        self._writers = set()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            hello = json.loads(await asyncio.wait_for(reader.readline(), _AUTH_TIMEOUT))
+        except (asyncio.TimeoutError, ValueError, OSError):
+            hello = {}
+        if not hmac.compare_digest(str(hello.get('token', '')).encode(), self.token.encode()):
+            logging.warning("Отклонено подключение к воркеру без верного токена.")
+            writer.close()
+            return
+
+        def send(message: dict):
+            if not writer.is_closing():
+                writer.write(encode(message))
+
+        tasks, answers = {}, {}
+        self._writers.add(writer)
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                call_id = message['id']
+                if message.get('cancel'):
+                    if call_id in tasks:
+                        tasks[call_id].cancel()
+                elif 'answer' in message:
+                    if call_id in answers:
+                        answers[call_id].put_nowait(message['answer'])
+                else:
+                    task = asyncio.create_task(self._run(message, send, answers))
+                    tasks[call_id] = task
+                    task.add_done_callback(lambda _, call_id=call_id: tasks.pop(call_id, None))
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Соединение с ботом прервано: {e!r}")
+        finally:
+            # Бот отключился — его вызовы больше никто не ждёт
+            for task in list(tasks.values()):
+                task.cancel()
+            self._writers.discard(writer)
+            writer.close()
+
+    def close_connections(self):
+        """Закрытие соединений завершает их обработчики: readline вернёт конец потока."""
+        for writer in list(self._writers):
+            writer.close()
+
+    async def _run(self, message: dict, send, answers: dict):
+        call_id = message['id']
+        current_user.set(message.get('user'))
+        current_class.set(message.get('job_class') or INTERACTIVE)
+        try:
+            if message.get('method') not in _METHODS or message.get('store') not in self.parsers:
+                raise ValueError(f"Неизвестный вызов {message.get('store')}.{message.get('method')}")
+            method = getattr(self.parsers[message['store']], message['method'])
+            args, kwargs = message.get('args', []), message.get('kwargs', {})
+            if message['method'] != 'stream_search_products':
+                send({'id': call_id, 'result': await method(*args, **kwargs)})
+                return
+            async def ask_bot(tile: dict) -> bool:
+                # Стоит ли загружать плитку, решает бот: ему известен текущий топ
+                send({'id': call_id, 'ask': tile})
+                return await answers[call_id].get()
+
+            if message.get('ask'):
+                answers[call_id] = asyncio.Queue()
+            worth_fetching = ask_bot if message.get('ask') else None
+            async for item in method(*args, worth_fetching=worth_fetching, **kwargs):
+                send({'id': call_id, 'item': item})
+            send({'id': call_id, 'end': True})
+        except Exception as e:
+            send({'id': call_id, 'error': encode_error(e)})
+        finally:
+            answers.pop(call_id, None)
+
+
+async def main(port: int):
+    await db.initialize_db()
+    ozon_parser = OzonParser()
+    wb_parser = WildberriesParser()
+    await wb_parser.start()
+    server = WorkerServer({'ozon': ozon_parser, 'wb': wb_parser}, os.environ.get(TOKEN_ENV, ''))
+    tcp_server = await asyncio.start_server(server.handle, PARSER_WORKER_HOST, port, limit=STREAM_LIMIT)
+    register_parser_metrics(ozon_parser)
+    metrics.register('price_history', price_history.stats)
+    background_tasks = [asyncio.create_task(price_history.run()), asyncio.create_task(metrics.run())]
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows: остановка через terminate()
+            pass
+    logging.info(f"Воркер парсинга слушает {PARSER_WORKER_HOST}:{port}.")
+    try:
+        await stop.wait()
+    finally:
+        tcp_server.close()
+        server.close_connections()
+        for task in background_tasks:
+            task.cancel()
+        await ozon_parser.quit()
+        await wb_parser.quit()
+        try:
+            await price_history.flush()
+        except Exception as e:
+            logging.error(f"Не удалось сохранить историю цен при остановке воркера: {e}")
+        await db.close_db()
+        logging.info(f"Воркер парсинга {port} остановлен.")
+
+
+if __name__ == '__main__':
+    worker_port = int(sys.argv[1])
+    logging.basicConfig(level=logging.INFO,
+                        format=f'%(asctime)s - worker {worker_port} - %(levelname)s - %(message)s')
+    asyncio.run(main(worker_port))
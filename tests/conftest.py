@@ -0,0 +1,4 @@
+import os
+
+# app.config требует токен бота уже при импорте
+os.environ.setdefault("BOT_TOKEN", "123456:test")
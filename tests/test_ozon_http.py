@@ -0,0 +1,25 @@
+from pathlib import Path
+
+from app.services.ozon_http import parse_product_html
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def test_parse_product_html():
+    page = (FIXTURES / "ozon_product.html").read_text(encoding="utf-8")
+
+    product = parse_product_html(page, "1234567890")
+
+    assert product["name"] == "Наушники беспроводные SoundCore Q20i, черный"
+    assert product["price"] == 1299
+    assert product["price_with_card"] == 1199
+    assert product["rating"] == 4.8
+    assert product["reviews_count"] == 1523
+    assert product["image_url"] == "https://cdn1.ozone.ru/s3/multimedia-1-x/wc1000/7003147281.jpg"
+    assert product["url"] == "https://www.ozon.ru/product/1234567890/"
+
+
+def test_parse_product_html_challenge_page():
+    page = "<html><head><title>Antibot Challenge Page</title></head><body><form class='challenge-form'></form></body></html>"
+
+    assert parse_product_html(page, "1234567890") is None